@@ -0,0 +1,104 @@
+import os
+import numpy as np
+
+IVF_FILE = "ivf.npz"
+# Training rows sampled per list when fitting centroids
+TRAIN_ROWS_PER_LIST = 64
+KMEANS_ITERATIONS = 10
+# Rows assigned to lists at a time (bounds the temporary score matrix)
+ASSIGN_BLOCK_ROWS = 8192
+
+
+def default_nlist(num_rows: int) -> int:
+    """
+    Number of inverted lists for a corpus: about 4 * sqrt(N), at least 1.
+    """
+    return max(1, int(4 * np.sqrt(num_rows)))
+
+
+def _as_float(block: np.ndarray) -> np.ndarray:
+    return np.asarray(block, dtype=np.float32)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index for cosine similarity on normalized rows.
+
+    Rows are clustered with spherical k-means; a query only scores the rows
+    of its nprobe closest lists. Larger nprobe means higher recall and more
+    work (nprobe == nlist is an exact scan).
+    """
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def num_rows(self) -> int:
+        """
+        Rows covered by the lists; rows appended after the build are scanned exactly.
+        """
+        return len(self.order)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: int = None, seed: int = 0) -> "IVFIndex":
+        """
+        Cluster the rows of matrix (any of the VectorDB storage dtypes) into nlist lists.
+        """
+        n = len(matrix)
+        nlist = min(nlist or default_nlist(n), n)
+        rng = np.random.default_rng(seed)
+        sample_idx = np.sort(rng.choice(n, size=min(n, nlist * TRAIN_ROWS_PER_LIST), replace=False))
+        sample = _normalize(_as_float(matrix[sample_idx]))
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # Reseed empty lists with random training rows
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, ASSIGN_BLOCK_ROWS):
+            block = _as_float(matrix[start : start + ASSIGN_BLOCK_ROWS])
+            assign[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        return cls(centroids.astype(np.float32), order, offsets)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Row ids in the nprobe lists whose centroids are closest to the query.
+        """
+        nprobe = min(max(nprobe, 1), self.nlist)
+        centroid_scores = self.centroids @ query
+        lists = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[l] : self.offsets[l + 1]] for l in lists])
+
+    def save(self, directory: str):
+        np.savez(os.path.join(directory, IVF_FILE),
+                 centroids=self.centroids, order=self.order, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, directory: str) -> "IVFIndex":
+        with np.load(os.path.join(directory, IVF_FILE)) as data:
+            return cls(data["centroids"], data["order"], data["offsets"])
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, IVF_FILE))
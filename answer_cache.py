@@ -0,0 +1,105 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL_SECONDS = 6 * 3600
+# Cosine similarity above which two questions are treated as the same question
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+def filter_key(filter: Optional[Dict[str, Any]]):
+    """
+    Hashable form of a retrieval filter ({"school": "TAMU"} or {"school": [...]}).
+    """
+    if not filter:
+        return None
+    return tuple(sorted((field, tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else value)
+                        for field, value in filter.items()))
+
+
+class SemanticAnswerCache:
+    """
+    In-process cache of final answers keyed by the (normalized) query embedding
+    and the retrieval filter the answer was produced with.
+
+    A lookup returns the answer of the most similar cached question asked with
+    the same filter if its cosine similarity reaches the threshold and the entry
+    has not expired. The filter is part of the key because questions that differ
+    only in the school they name ("TAMU tuition" / "ERAU tuition") embed close
+    together but retrieve from different schools.
+    Entries are evicted least-recently-used first, and everything is dropped
+    when the vector index version changes, since answers may cite stale chunks.
+    """
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._vectors = None              # (max_entries, dim) slot matrix, allocated on first put
+        self._entries = OrderedDict()     # slot -> (answer, expires_at, filter key); order = LRU -> MRU
+        self._free = list(range(max_entries - 1, -1, -1))
+        self._index_version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self, index_version):
+        if index_version != self._index_version:
+            self._entries.clear()
+            self._free = list(range(self.max_entries - 1, -1, -1))
+            self._index_version = index_version
+
+    def _drop(self, slot: int):
+        del self._entries[slot]
+        self._free.append(slot)
+
+    def get(self, query_vector: np.ndarray, index_version, filter: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """
+        Return the cached answer for a near-identical question, or None.
+
+        :param query_vector: Normalized query embedding (1-d or (1, d))
+        :param index_version: Current VectorDB.index_version
+        :param filter: Retrieval filter of the question; only answers cached with the same filter match
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32).ravel()
+        key = filter_key(filter)
+        with self._lock:
+            self._check_version(index_version)
+            now = time.monotonic()
+            for slot in [s for s, (_, expires_at, _) in self._entries.items() if expires_at <= now]:
+                self._drop(slot)
+            candidates = [s for s, (_, _, entry_key) in self._entries.items() if entry_key == key]
+            if not candidates:
+                self.misses += 1
+                return None
+            slots = np.array(candidates, dtype=np.intp)
+            scores = self._vectors[slots] @ query_vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            slot = int(slots[best])
+            self._entries.move_to_end(slot)
+            self.hits += 1
+            return self._entries[slot][0]
+
+    def put(self, query_vector: np.ndarray, answer: Any, index_version, filter: Optional[Dict[str, Any]] = None):
+        """
+        Cache answer for the question embedded as query_vector and retrieved with filter.
+        """
+        query_vector = np.asarray(query_vector, dtype=np.float32).ravel()
+        with self._lock:
+            self._check_version(index_version)
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(query_vector)), dtype=np.float32)
+            if not self._free:
+                self._drop(next(iter(self._entries)))  # least recently used
+            slot = self._free.pop()
+            self._vectors[slot] = query_vector
+            self._entries[slot] = (answer, time.monotonic() + self.ttl_seconds, filter_key(filter))
+
+    def __len__(self) -> int:
+        return len(self._entries)
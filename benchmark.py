@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import glob
+import time
+import zlib
+import argparse
+import tempfile
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+from bm25 import tokenize
+from embedding_cache import EmbeddingCache
+from query_cache import QueryEmbeddingCache
+from vector_db_schools import VectorDB
+from rerank import (HYBRID_CANDIDATE_MULTIPLIER, adaptive_candidates, chunk_to_content, make_reranker,
+                    rerank_results)
+
+# Golden Q&A format (one JSON object per line):
+#
+#   {"id": "erau-rotc",
+#    "query": "Does Embry-Riddle Daytona Beach offer ROTC programs?",
+#    "school": "ERAU",                                   optional: restrict retrieval to one school
+#    "relevant_chunks": [{"source_url": ..., "chunk_number": 28, "grade": 2}, ...],
+#    "relevant_sources": ["https://..."],                any chunk of these pages counts, grade 1
+#    "answer": "..."}                                    optional reference answer (not scored)
+#
+# A query needs relevant_chunks, relevant_sources or both. Chunk grades default
+# to 2; a chunk listed explicitly takes its own grade even if its page is also
+# in relevant_sources.
+
+CONTENT_DIR = "website_content"
+GOLDEN_PATH = "benchmarks/golden_qa.jsonl"
+STUB_DIM = 512
+DEFAULT_CHUNK_GRADE = 2
+SOURCE_GRADE = 1
+MODES = ("dense", "hybrid", "reranked")
+
+
+class StubEmbeddingClient:
+    """
+    Deterministic, offline stand-in for voyageai.Client: signed feature hashing
+    of unigrams and bigrams (crc32, so vectors are identical across runs and
+    machines). Texts sharing words get similar vectors, which is enough to
+    compare index and retrieval changes without the network.
+    """
+    def __init__(self, dim: int = STUB_DIM):
+        self.dim = dim
+
+    def _vector(self, text: str) -> List[float]:
+        tokens = tokenize(text)
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in features:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        return vector.tolist()
+
+    def embed(self, texts: List[str], model: str = None, input_type: str = None):
+        return _EmbedResult([self._vector(t) for t in texts])
+
+
+class _EmbedResult:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+
+def load_corpus(content_dir: str = CONTENT_DIR, schools: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Chunk records from website_content/<school>/chunks/*.jsonl, tagged with their school.
+    """
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(content_dir, "*", "chunks", "*.jsonl"))):
+        school = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        if schools and school not in schools:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    chunk = json.loads(line)
+                    chunk["school"] = school
+                    chunks.append(chunk)
+    return chunks
+
+
+def load_golden(path: str = GOLDEN_PATH) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        golden = [json.loads(line) for line in f if line.strip()]
+    for item in golden:
+        if not item.get("relevant_chunks") and not item.get("relevant_sources"):
+            raise ValueError(f"Golden query {item.get('id', item['query'])!r} has no relevant chunks or sources")
+    return golden
+
+
+def relevance_grades(item: Dict[str, Any], corpus_metadata: List[Dict[str, Any]]) -> Dict[Tuple[str, Any], int]:
+    """
+    Grade of every relevant (source_url, chunk_number) in the corpus for one golden query.
+    """
+    grades = {}
+    sources = set(item.get("relevant_sources", []))
+    if sources:
+        for meta in corpus_metadata:
+            if meta["source_url"] in sources:
+                grades[(meta["source_url"], meta["chunk_number"])] = SOURCE_GRADE
+    for rel in item.get("relevant_chunks", []):
+        grades[(rel["source_url"], rel["chunk_number"])] = rel.get("grade", DEFAULT_CHUNK_GRADE)
+    return grades
+
+
+def score_ranking(ranked: List[Dict[str, Any]], grades: Dict[Tuple[str, Any], int], k: int) -> Dict[str, float]:
+    """
+    recall@k, MRR and nDCG@k of one ranked list of metadata dicts.
+    Recall counts graded chunks for chunk-level judgments, otherwise distinct relevant pages.
+    """
+    found = [grades.get((meta["source_url"], meta["chunk_number"]), 0) for meta in ranked[:k]]
+    chunk_level = any(g > SOURCE_GRADE for g in grades.values())
+    if chunk_level:
+        wanted = {key for key, g in grades.items() if g > SOURCE_GRADE}
+        hit = {(m["source_url"], m["chunk_number"]) for m in ranked[:k]} & wanted
+        recall = len(hit) / len(wanted)
+    else:
+        wanted = {url for url, _ in grades}
+        recall = len({m["source_url"] for m in ranked[:k]} & wanted) / len(wanted) if wanted else 0.0
+    mrr = next((1.0 / (rank + 1) for rank, g in enumerate(found) if g > 0), 0.0)
+    dcg = sum((2 ** g - 1) / np.log2(rank + 2) for rank, g in enumerate(found))
+    ideal = sorted(grades.values(), reverse=True)[:k]
+    idcg = sum((2 ** g - 1) / np.log2(rank + 2) for rank, g in enumerate(ideal))
+    return {"recall": recall, "mrr": mrr, "ndcg": dcg / idcg if idcg else 0.0}
+
+
+def latency_stats(seconds: List[float]) -> Dict[str, float]:
+    """
+    p50/p95/p99 and mean in milliseconds, and throughput in calls per second.
+    """
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        "count": len(ms),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "throughput_qps": float(len(ms) / (ms.sum() / 1000.0)) if ms.sum() else float("inf"),
+    }
+
+
+def build_db(chunks: List[Dict[str, Any]], embedder: str, work_dir: str, dtype: str = "float32") -> VectorDB:
+    """
+    In-memory VectorDB over chunks. The stub embedder writes to caches under
+    work_dir so stub vectors never reach the shared embedding caches.
+    """
+    if embedder == "stub":
+        db = VectorDB("benchmark", voyage_client=StubEmbeddingClient(), dtype=dtype,
+                      embedding_cache=EmbeddingCache(os.path.join(work_dir, "embedding_cache.sqlite")),
+                      query_cache=QueryEmbeddingCache(os.path.join(work_dir, "query_cache.sqlite")))
+    elif embedder == "voyage":
+        db = VectorDB("benchmark", dtype=dtype,
+                      query_cache=QueryEmbeddingCache(os.path.join(work_dir, "query_cache.sqlite")))
+    else:
+        raise ValueError(f"Unknown embedder {embedder!r}; expected 'stub' or 'voyage'")
+    db.upsert_chunks(chunks)
+    return db
+
+
+def timed(stage_times: Dict[str, List[float]], stage: str, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    stage_times.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def run_benchmark(db: VectorDB, golden: List[Dict[str, Any]], k: int = 5, reranker_kind: str = "local",
+                  repeat: int = 1) -> Dict[str, Any]:
+    """
+    Evaluate dense, hybrid and reranked retrieval on the golden set.
+
+    :param db: Loaded VectorDB
+    :param golden: Golden queries (see the format above)
+    :param k: Cut-off for recall/nDCG and results per query
+    :param reranker_kind: "local" (offline) or "cohere"
+    :param repeat: Times each query is run; quality is scored on the first run,
+                   latency over all of them
+    :return: {"quality": {mode: metric means}, "latency": {stage: stats}, "per_query": [...]}
+    """
+    # Uncached, so repeated runs measure the reranker rather than the cache
+    reranker = make_reranker(reranker_kind, cache_size=0)
+    metadata = list(db.metadata)
+    stage_times = {}
+    totals = {mode: {"recall": 0.0, "mrr": 0.0, "ndcg": 0.0} for mode in MODES}
+    per_query = []
+
+    for item in golden:
+        grades = relevance_grades(item, metadata)
+        filter = {"school": item["school"]} if item.get("school") else None
+        for run in range(repeat):
+            # Repeats of a query hit the query embedding cache, as repeated questions do in production
+            start = time.perf_counter()
+            query_vector = timed(stage_times, "embed", db.embed_query, item["query"])[None, :]
+            dense = timed(stage_times, "dense", db.search_many, [item["query"]], k,
+                          filter=filter, query_vectors=query_vector)[0]
+            hybrid = timed(stage_times, "hybrid", db.hybrid_search, item["query"], k,
+                           filter=filter, query_vector=query_vector)
+            candidates = timed(stage_times, "rerank_candidates", db.hybrid_search, item["query"],
+                               k * HYBRID_CANDIDATE_MULTIPLIER, filter=filter, query_vector=query_vector)
+            candidates = adaptive_candidates(candidates, k)
+            documents = [chunk_to_content(res) for res in candidates]
+            ranked = timed(stage_times, "rerank", reranker.rerank, item["query"], documents, k)
+            reranked = rerank_results(ranked, candidates)
+            stage_times.setdefault("end_to_end", []).append(time.perf_counter() - start)
+            if run:
+                continue
+            rankings = {
+                "dense": [r["metadata"] for r in dense],
+                "hybrid": [r["metadata"] for r in hybrid],
+                "reranked": [r["chunk"] for r in reranked],
+            }
+            scores = {mode: score_ranking(rankings[mode], grades, k) for mode in MODES}
+            for mode in MODES:
+                for metric, value in scores[mode].items():
+                    totals[mode][metric] += value
+            per_query.append({"id": item.get("id"), "query": item["query"], **scores})
+
+    n = max(len(golden), 1)
+    return {
+        "k": k,
+        "queries": len(golden),
+        "corpus_chunks": len(metadata),
+        "quality": {mode: {metric: value / n for metric, value in metrics.items()} for mode, metrics in totals.items()},
+        "latency": {stage: latency_stats(times) for stage, times in stage_times.items()},
+        "per_query": per_query,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    k = report["k"]
+    print(f"\n{report['queries']} queries over {report['corpus_chunks']} chunks, k={k}")
+    print(f"\n{'mode':<10}{f'recall@{k}':>12}{'MRR':>10}{f'nDCG@{k}':>12}")
+    for mode, m in report["quality"].items():
+        print(f"{mode:<10}{m['recall']:>12.3f}{m['mrr']:>10.3f}{m['ndcg']:>12.3f}")
+    print(f"\n{'stage':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'qps':>10}")
+    for stage, s in report["latency"].items():
+        print(f"{stage:<20}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['throughput_qps']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark over website_content chunks")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="Golden Q&A JSONL file")
+    parser.add_argument("--content-dir", default=CONTENT_DIR)
+    parser.add_argument("--school", action="append", help="Only index this school (repeatable)")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--embedder", choices=["stub", "voyage"], default="stub")
+    parser.add_argument("--reranker", choices=["local", "cohere"], default="local")
+    parser.add_argument("--dtype", choices=["float32", "float16", "int8"], default="float32")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per query for latency percentiles")
+    parser.add_argument("--output", help="Write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    golden = load_golden(args.golden)
+    if args.school:
+        golden = [item for item in golden if item.get("school") in (None, *args.school)]
+    chunks = load_corpus(args.content_dir, args.school)
+    if not chunks:
+        print(f"No chunk files found under {args.content_dir}/*/chunks/")
+        return 1
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        db = build_db(chunks, args.embedder, work_dir, args.dtype)
+        report = run_benchmark(db, golden, args.k, args.reranker, args.repeat)
+        db.embedding_cache.close()
+        db.query_cache.close()
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
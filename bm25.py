@@ -0,0 +1,101 @@
+import os
+import re
+import json
+import numpy as np
+from collections import Counter
+from typing import List, Iterable, Dict
+
+# Keeps numbers like 12,345 / 3.5 and codes like aero201 together as single tokens
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,][0-9]+)*")
+K1 = 1.5
+B = 0.75
+
+POSTINGS_FILE = "bm25.npz"
+VOCAB_FILE = "bm25_vocab.json"
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    In-process BM25 inverted index in CSR layout: for term t, postings
+    indptr[t]:indptr[t+1] hold the matching rows and their precomputed
+    BM25 weights, so scoring a query is a handful of vectorized adds.
+    """
+    def __init__(self, vocab: Dict[str, int], indptr: np.ndarray, rows: np.ndarray,
+                 weights: np.ndarray, num_docs: int):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.rows = rows
+        self.weights = weights
+        self.num_docs = num_docs
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = K1, b: float = B) -> "BM25Index":
+        """
+        Build the index from one text per row.
+        """
+        vocab = {}
+        term_rows, term_ids, term_tfs, doc_lens = [], [], [], []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                term_rows.append(row)
+                term_tfs.append(tf)
+
+        num_docs = len(doc_lens)
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        rows = np.asarray(term_rows, dtype=np.int32)
+        tfs = np.asarray(term_tfs, dtype=np.float32)
+        doc_lens = np.asarray(doc_lens, dtype=np.float32)
+
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, rows, tfs = term_ids[order], rows[order], tfs[order]
+        counts = np.bincount(term_ids, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(counts)
+        df = counts.astype(np.float32)
+
+        idf = np.log1p((num_docs - df + 0.5) / (df + 0.5))
+        avgdl = float(doc_lens.mean()) if num_docs else 0.0
+        norm = k1 * (1 - b + b * doc_lens[rows] / avgdl) if avgdl else np.full_like(tfs, k1)
+        weights = (idf[term_ids] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+        return cls(vocab, indptr, rows, weights, num_docs)
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        BM25 score of every row for query (zeros for rows sharing no terms).
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # A row appears at most once per term, so plain fancy-index add is safe
+            scores[self.rows[start:end]] += self.weights[start:end]
+        return scores
+
+    def save(self, directory: str):
+        np.savez(os.path.join(directory, POSTINGS_FILE),
+                 indptr=self.indptr, rows=self.rows, weights=self.weights,
+                 num_docs=np.asarray(self.num_docs))
+        with open(os.path.join(directory, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str) -> "BM25Index":
+        with np.load(os.path.join(directory, POSTINGS_FILE)) as data:
+            indptr, rows, weights = data["indptr"], data["rows"], data["weights"]
+            num_docs = int(data["num_docs"])
+        with open(os.path.join(directory, VOCAB_FILE), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(vocab, indptr, rows, weights, num_docs)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, POSTINGS_FILE))
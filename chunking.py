@@ -1,53 +1,138 @@
 import os
 import json
-from typing import List, Any
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Any, Dict, Optional
 import anthropic
+from context_cache import ContextCache
 from dotenv import load_dotenv
 load_dotenv()
 # anthropic_api_key = ""
 # if anthropic_api_key is None:
 #             anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
 anthropic_client = anthropic.Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-def create_chunks_from_file(file_path: str, chunk_size: int = 512, chunk_overlap: int = 50) -> List[str]:
+
+# Concurrent situate_context calls shared by all files being chunked
+CONTEXT_WORKERS = int(os.getenv("CONTEXT_WORKERS", "8"))
+# Files chunked at the same time (their chunks share the pool above)
+FILE_WORKERS = int(os.getenv("CONTEXT_FILE_WORKERS", "4"))
+# Anthropic request budget for contextualization
+CONTEXT_REQUESTS_PER_MINUTE = float(os.getenv("CONTEXT_REQUESTS_PER_MINUTE", "50"))
+CONTEXT_MODEL = "claude-3-haiku-20240307"
+# Set (e.g. 0.9) to reuse a chunk's context from an earlier version of its page
+# when the page's estimated similarity to that version is at least this value
+CONTEXT_REUSE_SIMILARITY = os.getenv("CONTEXT_REUSE_SIMILARITY")
+
+context_cache = ContextCache(
+    similarity_threshold=float(CONTEXT_REUSE_SIMILARITY) if CONTEXT_REUSE_SIMILARITY else None
+)
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces calls evenly to stay within a per-minute budget.
+    """
+    def __init__(self, requests_per_minute: float = CONTEXT_REQUESTS_PER_MINUTE):
+        self.interval = 60.0 / requests_per_minute
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _doc_hash(doc_text: str) -> str:
+    return hashlib.sha256(doc_text.encode("utf-8")).hexdigest()
+
+
+def load_progress(progress_path: Optional[str], doc_hash: str) -> Dict[int, Dict[str, Any]]:
     """
-    Reads a text file and splits it into chunks for RAG.
-    
-    :param file_path: Path to the text file.
-    :param chunk_size: Maximum chunk size in characters.
-    :param chunk_overlap: Number of overlapping characters between chunks.
-    :return: List of text chunks.
+    Read chunks already contextualized for this exact document by an earlier (crashed) run.
+
+    :return: Mapping of chunk number -> chunk object
     """
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-    source_url=""
-    doc_text=""
-    with open(file_path, "r", encoding="utf-8") as file:
-        doc_text = file.read()
-        js = json.loads(doc_text)
-        source_url = js["source_url"]
-        content = js["content"]
-    
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, 
-        chunk_overlap=chunk_overlap, 
-        length_function=len
-    )
-    
-    chunks = text_splitter.split_text(content)
-    print(f"Number of chunks: {len(chunks)}")
-    updated_chunks = []
-    chunk_num = 0
-    for c in chunks: # [:5]:
-        contextualized_text, usage = situate_context(doc_text, c)
-        chunk_num += 1
+    done = {}
+    if not progress_path or not os.path.exists(progress_path):
+        return done
+    with open(progress_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash
+            if entry.get("doc_hash") == doc_hash:
+                done[entry["chunk"]["Chunk Number"]] = entry["chunk"]
+    return done
+
+
+def contextualize_chunks(doc_text: str, source_url: str, chunks: List[str],
+                         executor: ThreadPoolExecutor, limiter: RateLimiter,
+                         progress_path: Optional[str] = None,
+                         section_paths: Optional[List[List[str]]] = None) -> List[Dict[str, Any]]:
+    """
+    Run situate_context for every chunk of one document on a shared thread pool.
+
+    Chunks found in the context cache are reused without an LLM call. The first
+    remaining chunk is sent alone so the document prompt cache is written before
+    the rest fan out and read from it. Finished chunks are appended to
+    progress_path so a restarted run only redoes what is missing. section_paths
+    (one heading trail per chunk, from structure-aware chunking) is stored on
+    the chunk objects.
+
+    :return: Chunk objects ordered by chunk number
+    """
+    doc_hash = _doc_hash(doc_text)
+    done = load_progress(progress_path, doc_hash)
+
+    def section_of(chunk_num):
+        return section_paths[chunk_num - 1] if section_paths is not None else None
+    progress_lock = threading.Lock()
+
+    def record(c):
+        if progress_path:
+            with progress_lock, open(progress_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"doc_hash": doc_hash, "chunk": c}) + "\n")
+        return c
+
+    def run(chunk_num, chunk_text):
+        limiter.acquire()
+        contextualized_text, usage = situate_context(doc_text, chunk_text)
         print(f"Chunk #: {chunk_num}, Input Tokens: {usage.input_tokens} , Output Tokens: {usage.output_tokens} , Total Tokens: {usage.input_tokens + usage.output_tokens}, Cache Read: {usage.cache_read_input_tokens}, Cache Creation: {usage.cache_creation_input_tokens} ")
-        # 
-        c = create_json_object(chunk_num, source_url, contextualized_text,c)
-        updated_chunks.append(c)
-    return updated_chunks
+        context_cache.put(CONTEXT_MODEL, doc_text, chunk_text, contextualized_text)
+        return record(create_json_object(chunk_num, source_url, contextualized_text, chunk_text, section_of(chunk_num)))
+
+    if done:
+        print(f"Resuming {source_url}: {len(done)} of {len(chunks)} chunks already done")
+    # Contexts generated before for the same document and chunk text need no LLM call
+    pending = []
+    for n, c in enumerate(chunks, start=1):
+        if n in done:
+            continue
+        cached = context_cache.get(CONTEXT_MODEL, doc_text, c)
+        if cached is not None:
+            done[n] = create_json_object(n, source_url, cached, c, section_of(n))
+        else:
+            pending.append((n, c))
+    print(f"{source_url}: {len(pending)} of {len(chunks)} chunks need situate_context")
+    if pending:
+        # Warm the prompt cache with one request before fanning out
+        first_num, first_text = pending[0]
+        done[first_num] = run(first_num, first_text)
+        futures = [executor.submit(run, n, c) for n, c in pending[1:]]
+        for future in as_completed(futures):
+            c = future.result()
+            done[c["Chunk Number"]] = c
+    return [done[n] for n in range(1, len(chunks) + 1)]
+
 
-def create_json_object(chunk_num, source_url, context, chunk_text):
+def create_json_object(chunk_num, source_url, context, chunk_text, section_path=None):
 # def create_json_object(chunk_num, source_url,  chunk_text):
     """
     Creates a JSON object (Python dictionary) with specified data.
@@ -61,6 +146,9 @@ def create_json_object(chunk_num, source_url, context, chunk_text):
         "source_url": source_url,
         "chunk_text": chunk_text
     }
+    if section_path is not None:
+        # Heading trail of the chunk within its page (structure-aware chunking)
+        data["section_path"] = section_path
     return data
 
 
@@ -84,7 +172,7 @@ def situate_context(doc: str, chunk: str) -> tuple[str, Any]:
 
         # response = self.anthropic_client.beta.prompt_caching.messages.create(
         response = anthropic_client.beta.messages.create(
-            model="claude-3-haiku-20240307",
+            model=CONTEXT_MODEL,
             max_tokens=1000,
             temperature=0.0,
             messages=[
@@ -0,0 +1,272 @@
+import os
+import re
+import math
+import hashlib
+from typing import Any, Dict, Iterable, List
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+from structured_chunking import drop_repeated, render_block
+
+# "main": structured main content with boilerplate pruned; "full": all page text (the old behaviour)
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "main")
+# Blocks whose text is mostly link text (menus, link farms, "related" lists) are dropped
+LINK_DENSITY_MAX = 0.5
+# A block repeated on at least this many pages of one domain ...
+REPEAT_MIN_PAGES = 3
+# ... and on at least this share of the domain's crawled pages is site chrome
+REPEAT_MIN_SHARE = 0.5
+
+# Never content
+DROP_TAGS = ["script", "style", "noscript", "template", "iframe", "svg", "canvas", "object", "embed",
+             "form", "button", "input", "select", "textarea", "nav", "aside", "dialog"]
+# Page chrome unless it sits inside the main content (an article's own header holds its title)
+CHROME_TAGS = ["header", "footer"]
+CHROME_ROLES = {"navigation", "banner", "contentinfo", "search", "dialog", "alertdialog", "menu", "menubar",
+                "complementary"}
+# Words of an id/class that mark chrome. Hints are split into words on "-", "_",
+# whitespace and camelCase humps and matched whole, so "shareholder-report" or "modalities" is not
+# taken for a share bar or a modal; pairs are adjacent words
+BOILERPLATE_WORDS = {"cookie", "cookies", "consent", "gdpr", "breadcrumb", "breadcrumbs", "socials", "share",
+                     "sharing", "newsletter", "subscribe", "modal", "popup", "offcanvas", "megamenu", "navbar",
+                     "footer", "sidebar", "announcement", "skiplink", "skiplinks", "siteheader", "sitefooter",
+                     "globalnav", "alertbar"}
+BOILERPLATE_PAIRS = {("skip", "link"), ("skip", "links"), ("skip", "nav"), ("skip", "to"), ("mega", "menu"),
+                     ("site", "header"), ("site", "footer"), ("global", "header"), ("global", "footer"),
+                     ("global", "nav"), ("alert", "bar"), ("social", "links"), ("social", "icons"),
+                     ("social", "media"), ("social", "share")}
+HEADING_TAGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+TEXT_BLOCK_TAGS = {"p", "blockquote", "pre", "address", "figcaption", "caption"}
+LIST_TAGS = {"ul", "ol"}
+# Tags whose text runs together with the surrounding text
+INLINE_TAGS = {"a", "abbr", "b", "bdi", "bdo", "br", "cite", "code", "data", "dfn", "em", "i", "kbd", "label",
+               "mark", "q", "s", "samp", "small", "span", "strong", "sub", "sup", "time", "u", "var", "wbr",
+               "font", "img"}
+
+_SPACE_RE = re.compile(r"\s+")
+_HINT_SPLIT_RE = re.compile(r"[-_\s]+")
+_CAMEL_RE = re.compile(r"(?<=[a-z])(?=[A-Z])")
+# get_text(" ") puts a space between every string, also before punctuation that followed an inline tag
+_PUNCT_SPACE_RE = re.compile(r" ([,.;:!?)\]])")
+
+
+def clean_text(text: str) -> str:
+    return _PUNCT_SPACE_RE.sub(r"\1", _SPACE_RE.sub(" ", text)).strip()
+
+
+def block_text(block: Dict[str, Any]) -> str:
+    """
+    Plain text of a block (list items and table rows one per line).
+    """
+    if block["type"] == "list":
+        return "\n".join(block["items"])
+    if block["type"] == "table":
+        return "\n".join(" | ".join(row) for row in block["rows"])
+    return block["text"]
+
+
+def fingerprint(block: Dict[str, Any]) -> str:
+    return hashlib.sha1(clean_text(block_text(block)).lower().encode("utf-8")).hexdigest()[:16]
+
+
+def _has_boilerplate_hint(tag: Tag) -> bool:
+    for hint in [tag.get("id") or ""] + list(tag.get("class") or []):
+        words = [w for w in _HINT_SPLIT_RE.split(_CAMEL_RE.sub(" ", hint).lower()) if w]
+        if any(w in BOILERPLATE_WORDS for w in words) or any(p in BOILERPLATE_PAIRS for p in zip(words, words[1:])):
+            return True
+    return False
+
+
+def _is_chrome(tag: Tag) -> bool:
+    chrome = (tag.get("aria-hidden") == "true" or tag.has_attr("hidden") or tag.get("aria-modal") == "true"
+              or (tag.get("role") or "").lower() in CHROME_ROLES
+              or _has_boilerplate_hint(tag))
+    # A wrapper that holds the page title or the main content is never chrome
+    return chrome and tag.name not in ("main", "article") and tag.find(["h1", "main", "article"]) is None
+
+
+def _prune(soup: BeautifulSoup):
+    for tag in soup.find_all(DROP_TAGS):
+        tag.decompose()
+    for tag in soup.find_all(CHROME_TAGS):
+        if tag.find_parent(["main", "article"]) is None:
+            tag.decompose()
+    for tag in soup.find_all(True):
+        if tag.decomposed:
+            continue
+        if tag.name not in ("html", "body") and _is_chrome(tag):
+            tag.decompose()
+
+
+def _content_root(soup: BeautifulSoup) -> Tag:
+    main = soup.find("main") or soup.find(attrs={"role": "main"})
+    if main is not None:
+        return main
+    articles = soup.find_all("article")
+    if len(articles) == 1:
+        return articles[0]
+    return soup.body or soup
+
+
+def _link_density(tag: Tag, text: str) -> float:
+    if not text:
+        return 0.0
+    linked = sum(len(clean_text(a.get_text(" "))) for a in tag.find_all("a"))
+    return min(1.0, linked / len(text))
+
+
+def _list_items(tag: Tag) -> List[str]:
+    items = []
+    for li in tag.find_all("li", recursive=False):
+        text = clean_text(li.get_text(" "))
+        if text:
+            items.append(text)
+    return items
+
+
+def _table_rows(tag: Tag) -> List[List[str]]:
+    rows = []
+    for tr in tag.find_all("tr"):
+        if tr.find_parent("table") is not tag:
+            continue                            # row of a nested table
+        cells = [clean_text(cell.get_text(" ")) for cell in tr.find_all(["th", "td"], recursive=False)]
+        if any(cells):
+            rows.append(cells)
+    return rows
+
+
+def _walk(node: Tag, blocks: List[Dict[str, Any]], inline: List[str], inline_tags: List[Tag]):
+    def flush():
+        text = clean_text(" ".join(inline))
+        if text:
+            links = sum(len(clean_text(a.get_text(" "))) for t in inline_tags
+                        for a in ([t] if t.name == "a" else t.find_all("a")))
+            blocks.append({"type": "paragraph", "text": text, "link_density": min(1.0, links / len(text))})
+        inline.clear()
+        inline_tags.clear()
+
+    for child in node.children:
+        if isinstance(child, NavigableString):
+            if child.__class__ is NavigableString:      # skip comments, doctype, CDATA
+                inline.append(str(child))
+            continue
+        if not isinstance(child, Tag):
+            continue
+        name = child.name
+        if name in INLINE_TAGS:
+            inline.append(child.get_text(" "))
+            inline_tags.append(child)
+            continue
+        flush()
+        if name in HEADING_TAGS:
+            text = clean_text(child.get_text(" "))
+            if text:
+                blocks.append({"type": "heading", "level": HEADING_TAGS[name], "text": text})
+        elif name in TEXT_BLOCK_TAGS:
+            text = clean_text(child.get_text(" "))
+            if text:
+                blocks.append({"type": "paragraph", "text": text, "link_density": _link_density(child, text)})
+        elif name in LIST_TAGS:
+            items = _list_items(child)
+            if items:
+                blocks.append({"type": "list", "ordered": name == "ol", "items": items,
+                               "link_density": _link_density(child, "\n".join(items))})
+        elif name == "dl":
+            items, term = [], None
+            for item in child.find_all(["dt", "dd"], recursive=False):
+                text = clean_text(item.get_text(" "))
+                if item.name == "dt":
+                    term = text
+                elif text:
+                    items.append(f"{term}: {text}" if term else text)
+            if items:
+                blocks.append({"type": "list", "ordered": False, "items": items,
+                               "link_density": _link_density(child, "\n".join(items))})
+        elif name == "table":
+            rows = _table_rows(child)
+            if rows:
+                blocks.append({"type": "table", "rows": rows,
+                               "link_density": _link_density(child, "\n".join(" | ".join(r) for r in rows))})
+        else:
+            _walk(child, blocks, inline, inline_tags)
+            flush()
+    flush()
+
+
+def extract_blocks(html) -> List[Dict[str, Any]]:
+    """
+    Main content of a page as structured blocks, in document order:
+
+        {"type": "heading", "level": 2, "text": ...}
+        {"type": "paragraph", "text": ...}
+        {"type": "list", "ordered": False, "items": [...]}
+        {"type": "table", "rows": [[cell, ...], ...]}
+
+    Scripts, navigation, headers/footers outside the main content, cookie banners
+    and similar chrome are pruned by tag, role and id/class hints, then blocks
+    that are mostly link text. Every block carries its "fingerprint" for
+    cross-page repetition pruning (see drop_repeated).
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    _prune(soup)
+    blocks = []
+    _walk(_content_root(soup), blocks, [], [])
+
+    kept, seen = [], set()
+    for block in blocks:
+        if block.pop("link_density", 0.0) > LINK_DENSITY_MAX:
+            continue
+        block["fingerprint"] = fingerprint(block)
+        if block["type"] != "heading" and block["fingerprint"] in seen:
+            continue                                    # repeated within the page
+        seen.add(block["fingerprint"])
+        kept.append(block)
+    return kept
+
+
+def render_blocks(blocks: List[Dict[str, Any]]) -> str:
+    """
+    Blocks as Markdown-style text: "## Heading", paragraphs, "- item" lists and
+    "a | b" table rows, separated by blank lines.
+    """
+    return "\n\n".join(render_block(block) for block in blocks)
+
+
+def full_text(html) -> str:
+    """
+    All visible text of the page, as the crawler stored it before main-content extraction.
+    """
+    return BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True)
+
+
+class DomainRepetition:
+    """
+    Counts, per domain, how many pages contain each block fingerprint. A block on
+    at least min_pages pages and at least min_share of the domain's pages is site
+    chrome (menus, footers, contact strips) even where tags and classes did not
+    give it away. It is dropped from every page but the first one it was seen on,
+    so a block that is real content shared by many pages stays in the corpus once.
+    """
+    def __init__(self, min_pages: int = REPEAT_MIN_PAGES, min_share: float = REPEAT_MIN_SHARE):
+        self.min_pages = min_pages
+        self.min_share = min_share
+        self._pages = {}                # domain -> pages added
+        self._counts = {}               # domain -> fingerprint -> pages
+        self._first = {}                # domain -> fingerprint -> URL of the first page with it
+
+    def add_page(self, domain: str, url: str, fingerprints: Iterable[str]):
+        self._pages[domain] = self._pages.get(domain, 0) + 1
+        counts = self._counts.setdefault(domain, {})
+        first = self._first.setdefault(domain, {})
+        for fp in set(fingerprints):
+            counts[fp] = counts.get(fp, 0) + 1
+            first.setdefault(fp, url)
+
+    def repeated(self, domain: str, url: str = None) -> set:
+        """
+        Fingerprints to drop from the page at url (None: every repeated fingerprint).
+        """
+        min_pages = max(self.min_pages, math.ceil(self.min_share * self._pages.get(domain, 0)))
+        first = self._first.get(domain, {})
+        return {fp for fp, pages in self._counts.get(domain, {}).items()
+                if pages >= min_pages and first[fp] != url}
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import Optional
+from text_similarity import minhash_signature, estimate_jaccard
+
+DEFAULT_CACHE_PATH = "./data/context_cache.sqlite"
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ContextCache:
+    """
+    Persistent store of situate_context results keyed by
+    (model, hash of document text, hash of chunk text).
+
+    With similarity_threshold set, a miss on the exact document falls back to a
+    context generated for the same chunk text in an earlier version of the
+    document, as long as the two documents' estimated Jaccard similarity is at
+    least the threshold.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, similarity_threshold: Optional[float] = None):
+        self.path = path
+        self.similarity_threshold = similarity_threshold
+        self._conn = None
+        self._lock = threading.Lock()
+        # doc hash -> MinHash signature, for documents seen in this process
+        self._signatures = {}
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS contexts ("
+                " model TEXT NOT NULL, doc_hash TEXT NOT NULL, chunk_hash TEXT NOT NULL, context TEXT NOT NULL,"
+                " PRIMARY KEY (model, doc_hash, chunk_hash))"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS contexts_by_chunk ON contexts (model, chunk_hash)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents (doc_hash TEXT PRIMARY KEY, signature BLOB NOT NULL)"
+            )
+        return self._conn
+
+    def _signature(self, doc_hash: str, doc_text: str) -> np.ndarray:
+        if doc_hash not in self._signatures:
+            self._signatures[doc_hash] = minhash_signature(doc_text)
+        return self._signatures[doc_hash]
+
+    def get(self, model: str, doc_text: str, chunk_text: str) -> Optional[str]:
+        """
+        Return a stored context for this chunk of this document, or None.
+        """
+        doc_hash, chunk_hash = text_hash(doc_text), text_hash(chunk_text)
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT context FROM contexts WHERE model = ? AND doc_hash = ? AND chunk_hash = ?",
+                (model, doc_hash, chunk_hash),
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+                return row[0]
+            if self.similarity_threshold is not None:
+                context = self._get_similar(conn, model, doc_hash, doc_text, chunk_hash)
+                if context is not None:
+                    self.similar_hits += 1
+                    return context
+            self.misses += 1
+            return None
+
+    def _get_similar(self, conn, model, doc_hash, doc_text, chunk_hash) -> Optional[str]:
+        candidates = conn.execute(
+            "SELECT c.context, d.signature FROM contexts c JOIN documents d ON c.doc_hash = d.doc_hash"
+            " WHERE c.model = ? AND c.chunk_hash = ?",
+            (model, chunk_hash),
+        ).fetchall()
+        if not candidates:
+            return None
+        signature = self._signature(doc_hash, doc_text)
+        best_score, best_context = max(
+            (estimate_jaccard(signature, np.frombuffer(blob, dtype=np.uint32)), context)
+            for context, blob in candidates
+        )
+        return best_context if best_score >= self.similarity_threshold else None
+
+    def put(self, model: str, doc_text: str, chunk_text: str, context: str):
+        doc_hash, chunk_hash = text_hash(doc_text), text_hash(chunk_text)
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO contexts (model, doc_hash, chunk_hash, context) VALUES (?, ?, ?, ?)",
+                    (model, doc_hash, chunk_hash, context),
+                )
+                conn.execute(
+                    "INSERT OR IGNORE INTO documents (doc_hash, signature) VALUES (?, ?)",
+                    (doc_hash, self._signature(doc_hash, doc_text).tobytes()),
+                )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
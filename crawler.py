@@ -1,24 +1,33 @@
 import os
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import aiohttp
+from aiolimiter import AsyncLimiter
 import json
 import re
 from urllib.parse import urlparse
 import pprint
+from content_extraction import (EXTRACTION_MODE, DomainRepetition, drop_repeated, extract_blocks, fingerprint,
+                                full_text, render_blocks)
+from text_splitter import sanitize_filename
 
 # Create the folder if it doesn't exist
 os.makedirs('website_content', exist_ok=True)
 
-def sanitize_filename(url):
-    """
-    Create a safe filename from the URL.
-    """
-    parsed_url = urlparse(url)
-    filename = parsed_url.netloc + parsed_url.path  # Use domain and path for filename
-    filename = filename.replace('/', '_').replace(':', '_').replace('?', '_').replace('&', '_')  # Sanitize
-    if filename.endswith('_'):
-        filename = filename[:-1]
-    return filename
+OUTPUT_ROOT = "website_content"
+SUMMARY_PATH = "website_content/scrape_summary.json"
+# ETag / Last-Modified per URL, used for conditional requests on the next crawl
+CRAWL_STATE_PATH = "website_content/crawl_state.json"
+
+MAX_CONNECTIONS = 64          # shared connection pool size
+PER_HOST_CONCURRENCY = 4      # simultaneous requests to a single host
+PER_HOST_RATE = 5             # requests per second to a single host
+REQUEST_TIMEOUT = 30          # seconds, per request
+MAX_RETRIES = 4
+BACKOFF_BASE = 1.0            # seconds; doubled on each retry
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = "school-rag-crawler/1.0"
+
+
 # Method 1: Basic JSON loading
 def load_json_basic(file_path):
     """
@@ -26,46 +35,244 @@ def load_json_basic(file_path):
     """
     with open(file_path, 'r') as file:
         return json.load(file)
-    
+
+
+def load_json_or_default(file_path, default):
+    try:
+        return load_json_basic(file_path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def write_json(file_path, data):
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as json_file:
+        json.dump(data, json_file, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, file_path)
+
+
+class HostThrottle:
+    """
+    Per-host concurrency and rate limits, created lazily for each host seen.
+    """
+    def __init__(self, concurrency=PER_HOST_CONCURRENCY, rate=PER_HOST_RATE):
+        self.concurrency = concurrency
+        self.rate = rate
+        self._hosts = {}
+
+    def for_host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = (asyncio.Semaphore(self.concurrency), AsyncLimiter(self.rate, 1))
+        return self._hosts[host]
+
+
+def page_output_path(school, url):
+    return os.path.join(OUTPUT_ROOT, school, sanitize_filename(url) + ".json")
+
+
+def extract_page(html, mode=EXTRACTION_MODE):
+    """
+    Extract the page content from html. Runs in a worker thread.
+
+    :param mode: "main" for structured main-content blocks, "full" for all page text
+    :return: {"blocks": [...]} or {"text": ...} (also when no main content was found)
+    """
+    if mode == "main":
+        blocks = extract_blocks(html)
+        if blocks:
+            return {"blocks": blocks}
+    return {"text": full_text(html)}
+
+
+def save_page(full_path, url, page, repeated=()):
+    """
+    Write the page JSON: "content" is the text, and in main mode "blocks" keeps every
+    extracted block, with its heading, list and table structure, for chunking.
+    "repeated" lists the blocks left out of "content" (and of the chunks) as
+    boilerplate repeated across the domain, so they can be restored when that changes.
+
+    :param repeated: Block fingerprints to drop as boilerplate repeated across the domain
+    :return: Tuple of (saved text, fingerprints recorded as repeated)
+    """
+    page_data = {"source_url": url}
+    if "blocks" in page:
+        blocks = page["blocks"]
+        page_data["repeated"] = sorted(set(repeated) & {block.get("fingerprint") for block in blocks})
+        page_data["content"] = render_blocks(drop_repeated(blocks, page_data["repeated"]) or blocks)
+        page_data["blocks"] = blocks
+    else:
+        page_data["content"] = page["text"]
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    write_json(full_path, page_data)
+    return page_data["content"], page_data.get("repeated", [])
+
+
+def summary_entry(url, text):
+    # Generate a brief summary (first 500 characters as an example)
+    return {
+        "page": url,
+        "url": url,
+        "summary": text[:500]
+    }
+
+
+async def fetch_page(session, throttle, url, validators):
+    """
+    GET url with retries and backoff, sending conditional headers when we have validators.
+    Only RETRY_STATUSES, connection errors and timeouts are retried; other error
+    statuses (404, 403, ...) fail at once.
+
+    :return: Tuple of (status, body bytes or None, response headers or None)
+    """
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    semaphore, limiter = throttle.for_host(urlparse(url).netloc)
+    for attempt in range(MAX_RETRIES + 1):
+        delay = BACKOFF_BASE * (2 ** attempt)
+        try:
+            async with semaphore, limiter:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return 304, None, response.headers
+                    if response.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                        retry_after = response.headers.get("Retry-After", "")
+                        if retry_after.isdigit():
+                            delay = max(delay, float(retry_after))
+                    else:
+                        response.raise_for_status()
+                        return response.status, await response.read(), response.headers
+        except aiohttp.ClientResponseError as e:
+            # A 4xx (or any status outside RETRY_STATUSES) will not change on retry
+            if e.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                raise
+            print(f"Retrying {url} after error: {e}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            print(f"Retrying {url} after error: {e}")
+        await asyncio.sleep(delay)
+    raise RuntimeError(f"Giving up on {url} after {MAX_RETRIES} retries")
+
+
+async def crawl_url(session, throttle, school, url, crawl_state, repetition):
+    """
+    Fetch one URL and save its content unless the server reports it unchanged.
+    Blocks repeated across the domain are pruned as far as repetition knows them
+    (from the previous crawl); resave_repeated() settles them once every page
+    has been seen.
+
+    :return: Summary entry of the saved page, "unchanged", or None on failure
+    """
+    full_path = page_output_path(school, url)
+    # Only trust a 304 if we still have the page we saved last time
+    validators = crawl_state.get(url, {}) if os.path.exists(full_path) else {}
+    try:
+        status, body, headers = await fetch_page(session, throttle, url, validators)
+    except Exception as e:
+        print(f"Failed to fetch {url}: {e}")
+        return None
+    if status == 304:
+        print(f"Unchanged: {url}")
+        return "unchanged"
+
+    page = await asyncio.to_thread(extract_page, body)
+    text, repeated = await asyncio.to_thread(save_page, full_path, url, page,
+                                             repetition.repeated(urlparse(url).netloc, url))
+    print(f"Saved content from {url} to {os.path.basename(full_path)}")
+    crawl_state[url] = {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        # Kept so unchanged pages still count towards cross-page repetition
+        "block_fingerprints": [block["fingerprint"] for block in page.get("blocks", [])],
+        "repeated": repeated,
+    }
+    return summary_entry(url, text)
+
+
+def domain_repetition(jobs, crawl_state):
+    """
+    Cross-page block repetition of the crawled pages, counted in crawl order.
+    """
+    repetition = DomainRepetition()
+    for school, url in jobs:
+        repetition.add_page(urlparse(url).netloc, url, crawl_state.get(url, {}).get("block_fingerprints", []))
+    return repetition
+
+
+def resave_repeated(jobs, crawl_state):
+    """
+    Re-save the pages whose repeated blocks changed now that every page of their
+    domain has been seen. Only those pages are read back from disk.
+
+    :return: Summary entry per re-saved page
+    """
+    repetition = domain_repetition(jobs, crawl_state)
+    summaries = {}
+    for school, url in jobs:
+        state = crawl_state.get(url)
+        if not state or not state.get("block_fingerprints"):
+            continue
+        repeated = sorted(repetition.repeated(urlparse(url).netloc, url) & set(state["block_fingerprints"]))
+        full_path = page_output_path(school, url)
+        if repeated == state.get("repeated") or not os.path.exists(full_path):
+            continue
+        saved = load_json_basic(full_path)
+        if "blocks" not in saved:
+            continue
+        for block in saved["blocks"]:
+            # Pages saved before blocks kept their fingerprints
+            block.setdefault("fingerprint", fingerprint(block))
+        text, state["repeated"] = save_page(full_path, url, {"blocks": saved["blocks"]}, repeated)
+        print(f"Re-saved {os.path.basename(full_path)}: {len(repeated)} repeated blocks")
+        summaries[url] = summary_entry(url, text)
+    return summaries
+
+
+async def crawl(schools):
+    """
+    Crawl every URL of every school concurrently over one shared connection pool.
+
+    :param schools: Entries from config/school_url.json ({"school": ..., "urls": [...]})
+    :return: Summary entries for all pages (fresh and unchanged), in config order
+    """
+    crawl_state = load_json_or_default(CRAWL_STATE_PATH, {})
+    previous = {s["url"]: s for s in load_json_or_default(SUMMARY_PATH, [])}
+    throttle = HostThrottle()
+    connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, limit_per_host=PER_HOST_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    jobs = [(school["school"], url) for school in schools for url in school["urls"]]
+    # Pages are saved as they arrive, pruned by what the previous crawl knew
+    repetition = domain_repetition(jobs, crawl_state)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={"User-Agent": USER_AGENT}) as session:
+        results = await asyncio.gather(*(
+            crawl_url(session, throttle, school, url, crawl_state, repetition) for school, url in jobs
+        ))
+    saved = {url: result for (school, url), result in zip(jobs, results) if isinstance(result, dict)}
+    saved.update(await asyncio.to_thread(resave_repeated, jobs, crawl_state))
+
+    summaries = []
+    for school, url in jobs:
+        if url in saved:
+            summaries.append(saved[url])
+        elif url in previous:
+            summaries.append(previous[url])
+    write_json(CRAWL_STATE_PATH, crawl_state)
+    return summaries
+
+
 def scrape_and_generate_json(urls=[]):
-    summaries = []  # This will store the summary for each page
-    u = load_json_basic("config/school_url.json")
-    urls = []
-    for school in u:
-        for url in school["urls"]:
-            # urls.append(url)
-            response = requests.get(url)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            # Extract the text content (adjust this depending on your website's structure)
-            text = soup.get_text(separator=' ', strip=True)
-            # Sanitize the URL and create a safe filename for the JSON file
-            filename =  sanitize_filename(url) + ".json"           
-            # Create the data structure for the page content
-            page_data = {
-                "source_url": url,
-                "content": text
-            }
-
-            output_dir = "website_content/" + school["school"]
-            full_path = os.path.join(output_dir, filename)
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            with open(f"{full_path}", 'w', encoding='utf-8') as json_file:
-                json.dump(page_data, json_file, ensure_ascii=False, indent=4)
-            # Generate a brief summary (first 500 characters as an example)
-            summary = text[:500]  # You can adjust this as needed
-            
-            # Append the summary data for this page
-            summaries.append({
-                "page": url,
-                "url": url,
-                "summary": summary
-            })
-            
-            print(f"Saved content from {url} to {filename}")
-
-            # Save the overall summaries to a JSON file
-            with open("website_content/scrape_summary.json", "w", encoding="utf-8") as json_file:
-                json.dump(summaries, json_file, ensure_ascii=False, indent=4)
-                
-            print("Scrape summary saved to 'scrape_summary.json'")
-scrape_and_generate_json()
+    schools = load_json_basic("config/school_url.json")
+    summaries = asyncio.run(crawl(schools))
+    # Save the overall summaries to a JSON file, once, after the whole crawl
+    write_json(SUMMARY_PATH, summaries)
+    print("Scrape summary saved to 'scrape_summary.json'")
+
+
+if __name__ == "__main__":
+    scrape_and_generate_json()
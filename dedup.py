@@ -0,0 +1,138 @@
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from text_similarity import NUM_PERMUTATIONS, estimate_jaccard, minhash_signature
+from vector_db_schools import chunk_id, content_hash
+
+# A chunk whose estimated Jaccard similarity (word 5-shingles) to an earlier
+# chunk of the same school reaches this is collapsed into that chunk
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+# LSH banding of the MinHash signature: LSH_BANDS bands of NUM_PERMUTATIONS // LSH_BANDS
+# values. With 16 x 4, pairs at similarity 0.8 become candidates with probability ~0.9998
+LSH_BANDS = 16
+
+
+class NearDuplicateIndex:
+    """
+    MinHash LSH over chunk texts. Candidates share at least one band of their
+    signatures and are confirmed by the estimated Jaccard similarity.
+    """
+    def __init__(self, threshold: float = DEDUP_THRESHOLD, bands: int = LSH_BANDS):
+        if NUM_PERMUTATIONS % bands:
+            raise ValueError(f"{bands} bands do not divide {NUM_PERMUTATIONS} permutations")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERMUTATIONS // bands
+        self._keys = []                 # item -> caller's key
+        self._signatures = []           # item -> MinHash signature
+        self._buckets = {}              # (band, band bytes) -> items
+        self._exact = {}                # content hash -> item
+
+    def _band_keys(self, signature: np.ndarray):
+        return [(b, signature[b * self.rows:(b + 1) * self.rows].tobytes()) for b in range(self.bands)]
+
+    def query(self, text: str, signature: Optional[np.ndarray] = None) -> Optional[Hashable]:
+        """
+        :return: Key of the most similar indexed text at or above the threshold, or None
+        """
+        exact = self._exact.get(content_hash(text))
+        if exact is not None:
+            return self._keys[exact]
+        signature = minhash_signature(text) if signature is None else signature
+        best, best_similarity, seen = None, self.threshold, set()
+        for band_key in self._band_keys(signature):
+            for item in self._buckets.get(band_key, ()):
+                if item in seen:
+                    continue
+                seen.add(item)
+                similarity = estimate_jaccard(signature, self._signatures[item])
+                if similarity > best_similarity or (similarity == best_similarity and best is None):
+                    best, best_similarity = item, similarity
+        return self._keys[best] if best is not None else None
+
+    def add(self, key: Hashable, text: str, signature: Optional[np.ndarray] = None):
+        signature = minhash_signature(text) if signature is None else signature
+        item = len(self._keys)
+        self._keys.append(key)
+        self._signatures.append(signature)
+        self._exact.setdefault(content_hash(text), item)
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(item)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class ChunkDeduplicator:
+    """
+    Drops chunk records that nearly duplicate an earlier chunk of the same school
+    (shared navigation, footers, repeated notices) before they are embedded. The
+    first chunk seen stays canonical; the pages of its duplicates are collected
+    in duplicates[canonical chunk ID].
+
+    Schools are deduplicated separately so per-school filters keep every chunk
+    they need.
+    """
+    def __init__(self, threshold: float = DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self._indexes = {}                      # school -> NearDuplicateIndex
+        self.duplicates = {}                    # canonical chunk ID -> other source URLs, first seen first
+        self.counts = OrderedDict()             # school -> {"chunks": n, "duplicates": m}
+
+    def _index(self, school) -> NearDuplicateIndex:
+        index = self._indexes.get(school)
+        if index is None:
+            index = self._indexes[school] = NearDuplicateIndex(self.threshold)
+        return index
+
+    def seed(self, metadata: Iterable[Dict[str, Any]]):
+        """
+        Make already indexed rows canonical, so a partial run collapses new chunks
+        into chunks of pages it does not revisit. Seeded rows are not counted.
+
+        :param metadata: Index metadata of the rows to keep as canonical
+        """
+        for meta in metadata:
+            if meta.get("chunk_id"):            # rows from before chunk IDs cannot take duplicates
+                self._index(meta.get("school")).add((meta["chunk_id"], meta["source_url"]), meta["content"])
+
+    def filter(self, records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Pass canonical chunk records through, swallowing near-duplicates.
+        """
+        for record in records:
+            school = record.get("school")
+            index = self._index(school)
+            counts = self.counts.setdefault(school, {"chunks": 0, "duplicates": 0})
+            counts["chunks"] += 1
+
+            text = record["chunk_text"]
+            signature = minhash_signature(text)
+            canonical = index.query(text, signature)
+            if canonical is not None:
+                counts["duplicates"] += 1
+                canonical_id, canonical_url = canonical
+                if record["source_url"] != canonical_url:
+                    urls = self.duplicates.setdefault(canonical_id, [])
+                    if record["source_url"] not in urls:
+                        urls.append(record["source_url"])
+                continue
+            cid = chunk_id(record["source_url"], record.get("Chunk Number"), text)
+            index.add((cid, record["source_url"]), text, signature)
+            yield record
+
+    def ratios(self) -> Dict[str, float]:
+        """
+        Share of each school's chunks collapsed into an earlier one.
+        """
+        return {school: c["duplicates"] / c["chunks"] if c["chunks"] else 0.0 for school, c in self.counts.items()}
+
+    def report(self) -> List[str]:
+        lines = []
+        for school, c in self.counts.items():
+            lines.append(f"Dedup {school}: {c['duplicates']} of {c['chunks']} chunks collapsed "
+                         f"({c['duplicates'] / c['chunks']:.1%})" if c["chunks"] else f"Dedup {school}: no chunks")
+        return lines
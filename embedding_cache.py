@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict, Optional
+
+DEFAULT_CACHE_PATH = "./data/embedding_cache.sqlite"
+# SQLite caps the number of bound parameters per statement
+LOOKUP_BATCH = 500
+
+
+def embedding_key(model: str, text: str) -> str:
+    """
+    Content address of an embedding: hash of the model name and the exact text.
+    """
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent hash(model, text) -> float32 vector store backed by SQLite.
+    Safe to share between threads; separate processes coordinate through SQLite.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+        return self._conn
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """
+        Look up cached vectors.
+
+        :param model: Embedding model name
+        :param texts: Texts to look up
+        :return: Mapping of text -> vector for the texts that were cached
+        """
+        keys = {embedding_key(model, t): t for t in texts}
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            key_list = list(keys)
+            for i in range(0, len(key_list), LOOKUP_BATCH):
+                batch = key_list[i : i + LOOKUP_BATCH]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[keys[key]] = np.frombuffer(blob, dtype=np.float32)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model: str, texts: List[str], vectors):
+        """
+        Store vectors for texts (existing entries are left untouched).
+        """
+        rows = [
+            (embedding_key(model, t), np.asarray(v, dtype=np.float32).tobytes())
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
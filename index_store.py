@@ -0,0 +1,262 @@
+import os
+import sys
+import json
+import mmap
+import pickle
+import shutil
+import numpy as np
+from typing import List, Dict, Any, Iterable, Optional, Callable
+
+# On-disk layout (one directory per VectorDB):
+#
+#   index/CURRENT              name of the live generation directory
+#   index/query_cache.json     legacy query embeddings; imported into query_cache.sqlite on load
+#   index/gen-000001/
+#       header.json            format version, dtype, row count, dimension
+#       embeddings.npy         (count, dim) matrix, opened with mmap
+#       metadata.jsonl         one JSON object per row
+#       metadata.offsets.npy   (count + 1) byte offsets into metadata.jsonl
+#       bm25.npz, bm25_vocab.json  lexical index over the same rows (see bm25.py)
+#       ivf.npz                ANN lists for large corpora (see ann.py)
+#       partitions.json        {field: {value: [offset, count]}} into partition_rows.npy
+#       partition_rows.npy     row ids grouped by partition (school, domain, section)
+#
+# Writers build a complete new generation and then atomically replace CURRENT,
+# so readers never observe a half-written index and mmaps of the previous
+# generation stay valid until those readers reload.
+
+FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+HEADER_FILE = "header.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.jsonl"
+OFFSETS_FILE = "metadata.offsets.npy"
+QUERY_CACHE_FILE = "query_cache.json"
+PARTITIONS_FILE = "partitions.json"
+PARTITION_ROWS_FILE = "partition_rows.npy"
+# Old generations kept around for readers that have not reloaded yet
+KEEP_GENERATIONS = 2
+
+
+class LazyMetadata:
+    """
+    Read-only sequence view of metadata.jsonl. Rows are decoded on access
+    using the offsets index, so opening an index does not parse any metadata.
+    """
+    def __init__(self, metadata_path: str, offsets_path: str):
+        self.metadata_path = metadata_path
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._file = open(metadata_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return max(len(self.offsets) - 1, 0)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = int(idx)
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("metadata index out of range")
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return json.loads(self._mmap[start:end])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+
+def current_marker(index_dir: str) -> str:
+    """
+    Path of the CURRENT pointer file; its mtime changes on every save.
+    """
+    return os.path.join(index_dir, CURRENT_FILE)
+
+
+def index_exists(index_dir: str) -> bool:
+    return os.path.exists(current_marker(index_dir))
+
+
+def current_generation_dir(index_dir: str) -> str:
+    with open(current_marker(index_dir), "r", encoding="utf-8") as f:
+        return os.path.join(index_dir, f.read().strip())
+
+
+def _next_generation_name(index_dir: str) -> str:
+    generations = [d for d in os.listdir(index_dir) if d.startswith("gen-")] if os.path.isdir(index_dir) else []
+    latest = max((int(d.split("-")[1]) for d in generations if d.split("-")[1].isdigit()), default=0)
+    return f"gen-{latest + 1:06d}"
+
+
+def _atomic_write_text(path: str, text: str):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_index(index_dir: str, embeddings: np.ndarray, metadata: Iterable[Dict[str, Any]],
+                dtype: str, extra_header: Optional[Dict[str, Any]] = None,
+                extra_writer: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Write a new index generation and make it current.
+
+    :param index_dir: Index root directory
+    :param embeddings: (count, dim) embedding matrix
+    :param metadata: Per-row metadata dictionaries, in row order
+    :param dtype: Storage dtype name recorded in the header
+    :param extra_header: Additional header fields (e.g. embedding model)
+    :param extra_writer: Called with the generation directory to write side
+                         structures (e.g. the BM25 index) before it goes live
+    :return: Path of the new generation directory
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    generation = _next_generation_name(index_dir)
+    gen_dir = os.path.join(index_dir, generation)
+    os.makedirs(gen_dir)
+
+    embeddings = np.ascontiguousarray(embeddings)
+    np.save(os.path.join(gen_dir, EMBEDDINGS_FILE), embeddings)
+
+    offsets = [0]
+    with open(os.path.join(gen_dir, METADATA_FILE), "wb") as f:
+        for meta in metadata:
+            line = json.dumps(meta, ensure_ascii=False).encode("utf-8") + b"\n"
+            f.write(line)
+            offsets.append(offsets[-1] + len(line))
+    if len(offsets) - 1 != len(embeddings):
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        raise ValueError(f"Metadata rows ({len(offsets) - 1}) do not match embedding rows ({len(embeddings)})")
+    np.save(os.path.join(gen_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.uint64))
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "dtype": dtype,
+        "count": int(embeddings.shape[0]),
+        "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+    }
+    header.update(extra_header or {})
+    if extra_writer is not None:
+        extra_writer(gen_dir)
+    _atomic_write_text(os.path.join(gen_dir, HEADER_FILE), json.dumps(header, indent=2))
+    _atomic_write_text(current_marker(index_dir), generation)
+    _prune_generations(index_dir, generation)
+    return gen_dir
+
+
+def _prune_generations(index_dir: str, current: str):
+    generations = sorted(d for d in os.listdir(index_dir) if d.startswith("gen-"))
+    stale = [d for d in generations if d != current][:-(KEEP_GENERATIONS - 1) or None]
+    for d in stale:
+        shutil.rmtree(os.path.join(index_dir, d), ignore_errors=True)
+
+
+def open_index(index_dir: str):
+    """
+    Open the current generation without reading embeddings or metadata into memory.
+    CURRENT is read once; load the generation's side indexes (BM25, IVF,
+    partitions) from the returned gen_dir so every part comes from the same save.
+
+    :return: Tuple of (generation directory, header dict, memory-mapped embeddings, LazyMetadata)
+    """
+    gen_dir = current_generation_dir(index_dir)
+    with open(os.path.join(gen_dir, HEADER_FILE), "r", encoding="utf-8") as f:
+        header = json.load(f)
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {header.get('format_version')} in {gen_dir}")
+    embeddings = np.load(os.path.join(gen_dir, EMBEDDINGS_FILE), mmap_mode="r")
+    metadata = LazyMetadata(os.path.join(gen_dir, METADATA_FILE), os.path.join(gen_dir, OFFSETS_FILE))
+    return gen_dir, header, embeddings, metadata
+
+
+def save_partitions(gen_dir: str, partitions: Dict[str, Dict[str, np.ndarray]]):
+    """
+    Write per-field row partitions as one concatenated row array plus a JSON directory.
+    """
+    directory, chunks, offset = {}, [], 0
+    for field, values in partitions.items():
+        directory[field] = {}
+        for value, rows in values.items():
+            directory[field][value] = [offset, len(rows)]
+            chunks.append(np.asarray(rows, dtype=np.int64))
+            offset += len(rows)
+    np.save(os.path.join(gen_dir, PARTITION_ROWS_FILE),
+            np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64))
+    with open(os.path.join(gen_dir, PARTITIONS_FILE), "w", encoding="utf-8") as f:
+        json.dump(directory, f, ensure_ascii=False)
+
+
+def load_partitions(gen_dir: str) -> Optional[Dict[str, Dict[str, np.ndarray]]]:
+    """
+    Load partitions written by save_partitions, or None if the generation has none.
+    Row arrays are slices of one memory-mapped file.
+    """
+    path = os.path.join(gen_dir, PARTITIONS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        directory = json.load(f)
+    rows = np.load(os.path.join(gen_dir, PARTITION_ROWS_FILE), mmap_mode="r")
+    return {
+        field: {value: rows[start : start + count] for value, (start, count) in values.items()}
+        for field, values in directory.items()
+    }
+
+
+def load_query_cache(index_dir: str) -> Dict[str, List[float]]:
+    path = os.path.join(index_dir, QUERY_CACHE_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_query_cache(index_dir: str, query_cache: Dict[str, List[float]]):
+    os.makedirs(index_dir, exist_ok=True)
+    _atomic_write_text(os.path.join(index_dir, QUERY_CACHE_FILE), json.dumps(query_cache))
+
+
+def convert_pickle(pickle_path: str, index_dir: str, dtype: str = "float32") -> str:
+    """
+    One-shot conversion of a legacy schools_db.pkl into the directory format.
+
+    :param pickle_path: Path to the legacy pickle
+    :param index_dir: Destination index root directory
+    :param dtype: Storage dtype for the converted embeddings
+    :return: Path of the written generation directory
+    """
+    # Imported here to avoid a circular import (vector_db_schools imports this module)
+    from vector_db_schools import EMBEDDING_DTYPES, INT8_SCALE, normalize_rows
+
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    embeddings = normalize_rows(data["embeddings"]) if len(data["embeddings"]) else np.empty((0, 0), np.float32)
+    if dtype == "int8":
+        embeddings = np.clip(np.rint(embeddings * INT8_SCALE), -127, 127)
+    embeddings = embeddings.astype(EMBEDDING_DTYPES[dtype])
+
+    query_cache = data.get("query_cache", {})
+    if isinstance(query_cache, str):
+        query_cache = json.loads(query_cache)
+    save_query_cache(index_dir, query_cache if isinstance(query_cache, dict) else {})
+    return write_index(index_dir, embeddings, data["metadata"], dtype,
+                       {"converted_from": os.path.basename(pickle_path)})
+
+
+if __name__ == "__main__":
+    # Usage: python index_store.py data/school_db/schools_db.pkl data/school_db/index [dtype]
+    if len(sys.argv) < 3:
+        print("Usage: python index_store.py <schools_db.pkl> <index_dir> [float32|float16|int8]")
+        sys.exit(1)
+    out = convert_pickle(sys.argv[1], sys.argv[2], *(sys.argv[3:4]))
+    print(f"Converted {sys.argv[1]} -> {out}")
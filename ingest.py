@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import argparse
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Tuple
+
+import index_store
+from dedup import DEDUP_THRESHOLD, ChunkDeduplicator
+from chunking import CONTEXT_WORKERS, FILE_WORKERS, RateLimiter, contextualize_chunks
+from structured_chunking import CHUNK_TOKENS, chunk_page_file
+from text_splitter import read_page, sanitize_filename
+from vector_db_schools import VectorDB, chunk_id
+
+# Ingestion pipeline, one generator per stage:
+#
+#   discover -> parse + chunk -> contextualize -> dedup -> embed + write
+#
+# Pages stream through the stages one at a time and chunks reach the index in
+# batches of --batch-size, so memory holds a window of pages, one batch and
+# the index itself rather than the whole corpus. Parsing and splitting run on
+# a process pool. Pages whose _chunk.jsonl is newer than the page skip
+# parse/chunk/contextualize and are read from disk. Near-duplicate chunks
+# (shared navigation and footers) are collapsed per school before embedding;
+# a partial run also collapses them into the indexed chunks of other pages.
+#
+#   python ingest.py                           everything under website_content/
+#   python ingest.py --school TAMU --school ERAU
+#   python ingest.py --since 2025-03-01        pages crawled on or after a date
+#   python ingest.py --since 2d                ... or within a recent window
+
+CONTENT_DIR = "website_content"
+DB_NAME = "school_db"
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# Chunks per upsert; each batch is embedded (cache misses only) and appended
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "512"))
+# Processes parsing and splitting pages (0: split on the calling thread)
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", str(os.cpu_count() or 1)))
+# Pages scheduled together on the chunking pool, largest first
+CHUNK_WINDOW = 64
+
+
+def chunk_output_path(file_path: str) -> str:
+    """
+    Path of the _chunk.jsonl file for a crawled page JSON.
+    """
+    folder, name = os.path.split(file_path)
+    return os.path.join(folder, "chunks", f"{name}_chunk.jsonl")
+
+
+def save_jsonl(data: List[Dict[str, Any]], filename: str):
+    """
+    Write records as JSON lines, replacing filename atomically.
+    """
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    tmp_path = f"{filename}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for entry in data:
+            json.dump(entry, f)
+            f.write("\n")
+    os.replace(tmp_path, filename)
+
+
+def read_jsonl(filename: str) -> Iterator[Dict[str, Any]]:
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def parse_since(value: str) -> float:
+    """
+    --since value as a Unix timestamp: an ISO date or datetime, or a window
+    back from now such as "12h" or "7d".
+    """
+    units = {"h": 3600, "d": 86400}
+    if value[-1:].lower() in units and value[:-1].isdigit():
+        return time.time() - int(value[:-1]) * units[value[-1].lower()]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a date (2025-03-01), datetime or window (12h, 7d): {value!r}")
+
+
+# --- stages -----------------------------------------------------------------
+
+def discover(content_dir: str = CONTENT_DIR, schools: Optional[Iterable[str]] = None,
+             since: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Crawled page files, school by school.
+
+    :param schools: Only these school folders (default: all)
+    :param since: Only pages written at or after this Unix time
+    :return: Jobs {"school", "file_path", "output_path", "mtime"}
+    """
+    schools = set(schools) if schools else None
+    for school in sorted(os.listdir(content_dir)):
+        folder = os.path.join(content_dir, school)
+        if not os.path.isdir(folder) or (schools is not None and school not in schools):
+            continue
+        with os.scandir(folder) as entries:
+            pages = sorted((e for e in entries if e.is_file() and e.name.endswith(".json")), key=lambda e: e.name)
+        for entry in pages:
+            mtime = entry.stat().st_mtime
+            if since is not None and mtime < since:
+                continue
+            yield {"school": school, "file_path": entry.path,
+                   "output_path": chunk_output_path(entry.path), "mtime": mtime}
+
+
+def needs_chunking(job: Dict[str, Any]) -> bool:
+    output_path = job["output_path"]
+    return not os.path.exists(output_path) or os.path.getmtime(output_path) < job["mtime"]
+
+
+def chunk(jobs: Iterable[Dict[str, Any]], chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+          workers: int = CHUNK_WORKERS,
+          chunk_tokens: int = CHUNK_TOKENS) -> Iterator[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+    """
+    Parse and split the pages that need (re)chunking on a process pool. Pages
+    saved with their structure are chunked by section into chunk_tokens-sized
+    chunks, the rest by characters (chunk_size/chunk_overlap).
+
+    Jobs are taken CHUNK_WINDOW at a time and submitted largest file first, so
+    idle workers keep pulling the next biggest page and one huge page does not
+    end up last; results are still yielded in input order.
+
+    :return: (job, document) pairs; document ({"doc_text", "source_url", "chunks",
+             "section_paths"}) is None when the chunk file is current
+    """
+    def window_results(window, pool):
+        todo = [job for job in window if needs_chunking(job)]
+        todo.sort(key=lambda job: -os.path.getsize(job["file_path"]))
+        if pool is None:
+            futures = {id(job): chunk_page_file(job["file_path"], chunk_size, chunk_overlap, chunk_tokens)
+                       for job in todo}
+        else:
+            futures = {id(job): pool.submit(chunk_page_file, job["file_path"], chunk_size, chunk_overlap,
+                                            chunk_tokens)
+                       for job in todo}
+        for job in window:
+            result = futures.get(id(job))
+            if result is None:
+                yield job, None
+                continue
+            doc_text, source_url, chunks, section_paths = result if pool is None else result.result()
+            yield job, {"doc_text": doc_text, "source_url": source_url, "chunks": chunks,
+                        "section_paths": section_paths}
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        window = []
+        for job in jobs:
+            window.append(job)
+            if len(window) >= CHUNK_WINDOW:
+                yield from window_results(window, pool)
+                window = []
+        yield from window_results(window, pool)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def contextualize(chunked: Iterable[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]],
+                  limiter: RateLimiter = None) -> Iterator[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+    """
+    Situate the chunks of up to FILE_WORKERS pages at a time on shared pools and
+    write each page's _chunk.jsonl. Pages come out in input order.
+
+    :return: (job, chunk records) per page
+    """
+    limiter = limiter or RateLimiter()
+    with ThreadPoolExecutor(max_workers=CONTEXT_WORKERS) as chunk_executor, \
+         ThreadPoolExecutor(max_workers=FILE_WORKERS) as file_executor:
+        def run(job, document):
+            # Progress survives a crash in "<output_path>.partial" until the page is done
+            progress_path = job["output_path"] + ".partial"
+            os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+            records = contextualize_chunks(document["doc_text"], document["source_url"], document["chunks"],
+                                           chunk_executor, limiter, progress_path, document["section_paths"])
+            save_jsonl(records, job["output_path"])
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
+            print(f"Chunked {job['file_path']}: {len(records)} chunks")
+            return records
+
+        def finish(job, future):
+            return job, future.result() if future is not None else list(read_jsonl(job["output_path"]))
+
+        in_flight = deque()
+        for job, document in chunked:
+            in_flight.append((job, file_executor.submit(run, job, document) if document is not None else None))
+            while in_flight and (in_flight[0][1] is None or in_flight[0][1].done()
+                                 or len(in_flight) > FILE_WORKERS):
+                yield finish(*in_flight.popleft())
+        while in_flight:
+            yield finish(*in_flight.popleft())
+
+
+def chunk_records(pages: Iterable[Tuple[Dict[str, Any], List[Dict[str, Any]]]]) -> Iterator[Dict[str, Any]]:
+    """
+    Flatten pages into chunk records tagged with their school folder (for per-school partitions).
+    """
+    for job, records in pages:
+        for record in records:
+            record["school"] = job["school"]
+            yield record
+
+
+def batched(records: Iterable[Dict[str, Any]], size: int = BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write(db: VectorDB, batches: Iterable[List[Dict[str, Any]]], schools: Optional[Iterable[str]] = None,
+          sources: Optional[Iterable[str]] = None, duplicates: Optional[Dict[str, List[str]]] = None) -> Dict[str, int]:
+    """
+    Embed and upsert batch by batch, then delete indexed chunks that were not seen
+    and record the pages of collapsed duplicates on their canonical rows.
+
+    :param schools: Deletions are limited to these schools (default: all)
+    :param sources: Source URLs of the pages visited by a partial run (--since); deletions
+                    and duplicate-source updates are limited to them (default: all pages)
+    :param duplicates: Canonical chunk ID -> source URLs of its duplicates (filled while batches stream)
+    :return: Upsert, delete and source-list update counts
+    """
+    stats = {"added": 0, "updated": 0, "replaced": 0, "unchanged": 0}
+    keep = set()
+    for batch in batches:
+        for key, value in db.upsert_chunks(batch).items():
+            stats[key] += value
+        for record in batch:
+            keep.add(chunk_id(record["source_url"], record.get("Chunk Number"), record["chunk_text"]))
+        print(f"Indexed {len(keep)} chunks: {stats}")
+    stats["deleted"] = db.prune_chunks(keep, sources=sources, schools=set(schools) if schools else None)
+    if sources is None:
+        stats["sources_merged"] = db.set_duplicate_sources(keep, duplicates or {})
+    else:
+        # Rows of pages this run did not visit may have taken duplicates too
+        stats["sources_merged"] = db.set_duplicate_sources(None, duplicates or {}, sources=sources)
+    return stats
+
+
+def plan_partial(db: VectorDB, jobs: List[Dict[str, Any]], content_dir: str = CONTENT_DIR,
+                 schools: Optional[Iterable[str]] = None,
+                 deduplicator: Optional[ChunkDeduplicator] = None) -> Tuple[List[Dict[str, Any]], set]:
+    """
+    Prepare a partial (--since) run. Reads the source URL of every selected page.
+    Pages whose chunks were collapsed into rows of a selected page are selected
+    too, since those rows may change or go and the pages then need rows of their
+    own. The indexed rows of every other page seed the deduplicator, so new
+    chunks still collapse into them.
+
+    :return: Tuple of (jobs including the added pages, source URLs of all selected pages)
+    """
+    jobs = list(jobs)
+    sources = {read_page(job["file_path"])[1]["source_url"] for job in jobs}
+    rows = db.live_metadata(set(schools) if schools else None)
+    by_source = {}
+    for meta in rows:
+        by_source.setdefault(meta["source_url"], []).append(meta)
+
+    pending = list(sources)
+    while pending:
+        for meta in by_source.get(pending.pop(), ()):
+            for url in meta.get("source_urls", [])[1:]:
+                file_path = os.path.join(content_dir, meta.get("school") or "", sanitize_filename(url) + ".json")
+                if url in sources or not os.path.exists(file_path):
+                    continue
+                sources.add(url)
+                pending.append(url)
+                jobs.append({"school": meta["school"], "file_path": file_path,
+                             "output_path": chunk_output_path(file_path), "mtime": os.path.getmtime(file_path)})
+    if deduplicator is not None:
+        deduplicator.seed(meta for meta in rows if meta["source_url"] not in sources)
+    return jobs, sources
+
+
+def run_pipeline(db: VectorDB, content_dir: str = CONTENT_DIR, schools: Optional[List[str]] = None,
+                 since: Optional[float] = None, batch_size: int = BATCH_SIZE, chunk_size: int = CHUNK_SIZE,
+                 chunk_overlap: int = CHUNK_OVERLAP, chunk_workers: int = CHUNK_WORKERS,
+                 chunk_tokens: int = CHUNK_TOKENS, dedup_threshold: Optional[float] = DEDUP_THRESHOLD) -> Dict[str, int]:
+    """
+    Bring db in line with the crawled pages selected by schools and since, and save it if anything changed.
+
+    :param dedup_threshold: Similarity at which chunks are collapsed (None: keep every chunk)
+    """
+    jobs = discover(content_dir, schools, since)
+    deduplicator = ChunkDeduplicator(dedup_threshold) if dedup_threshold is not None else None
+    sources = None
+    if since is not None:
+        jobs, sources = plan_partial(db, jobs, content_dir, schools, deduplicator)
+    records = chunk_records(contextualize(chunk(jobs, chunk_size, chunk_overlap, chunk_workers, chunk_tokens)))
+    if deduplicator is not None:
+        records = deduplicator.filter(records)
+    stats = write(db, batched(records, batch_size), schools, sources=sources,
+                  duplicates=deduplicator.duplicates if deduplicator is not None else None)
+    if deduplicator is not None:
+        for line in deduplicator.report():
+            print(line)
+    print(f"Index sync: {stats}")
+    if stats["added"] or stats["updated"] or stats["replaced"] or stats["deleted"] or stats["sources_merged"] \
+            or not index_store.index_exists(db.db_path):
+        db.save_db()
+        print(f"Vector database saved. Total chunks: {db.live_count}")
+    else:
+        print("Vector database is up to date.")
+    return stats
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Chunk, contextualize and index crawled school pages.")
+    parser.add_argument("--school", action="append", dest="schools",
+                        help="School folder under the content dir (repeatable; default: all)")
+    parser.add_argument("--since", type=parse_since,
+                        help="Only pages crawled since an ISO date/datetime or a window such as 12h or 7d")
+    parser.add_argument("--content-dir", default=CONTENT_DIR)
+    parser.add_argument("--db-name", default=DB_NAME)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="Characters per chunk for pages saved without structure")
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS,
+                        help="Tokens per chunk for pages saved with headings/lists/tables (0: split by characters)")
+    parser.add_argument("--chunk-workers", type=int, default=CHUNK_WORKERS,
+                        help="Processes splitting pages (0 or 1: no pool)")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="Estimated Jaccard similarity at which chunks of a school are collapsed")
+    parser.add_argument("--no-dedup", action="store_true", help="Index near-duplicate chunks as they are")
+    args = parser.parse_args(argv)
+
+    db = VectorDB(args.db_name)
+    db.load_vector_db()
+    run_pipeline(db, args.content_dir, args.schools, args.since, args.batch_size,
+                 args.chunk_size, args.chunk_overlap, args.chunk_workers, args.chunk_tokens,
+                 None if args.no_dedup else args.dedup_threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,115 +1,158 @@
+import time
+import asyncio
 import anthropic
 import typing
 import pprint
+from metrics import span, record_stage, record_token_usage
+from prompt_builder import PromptBuilder, PROMPT_TOKEN_BUDGET
+
+MODEL = "claude-3-haiku-20240307"
+MAX_RESPONSE_TOKENS = 500
 
 class LLMResponse:
-    def __init__(self, anthropic_client):
+    def __init__(self, anthropic_client, async_client=None):
         # self.vector_db = vector_db
         self.anthropic_client = anthropic_client
+        # anthropic.AsyncAnthropic used by agenerate_response / astream_response
+        self.async_client = async_client
+        # Token usage of the most recent call, including prompt cache reads/writes
+        self.last_usage = None
     
+    def build_prompt(self, query: str, retrieved_context_chunks, history=None,
+                     token_budget: int = PROMPT_TOKEN_BUDGET, schools=None):
+        """
+        Build the system prompt and messages within the token budget
+        
+        Args:
+            query (str): User's current question
+            retrieved_context_chunks: Reranked chunks ({"chunk": metadata, "score": ...})
+            history: Prior turns [{"user": ..., "ai": ...}], oldest first
+            token_budget (int): Input tokens shared by chunks and history
+            schools: Schools whose static context goes into the cached prefix
+        
+        Returns:
+            Tuple of (system blocks, messages)
+        """
+        with span("prompt_build"):
+            return PromptBuilder(token_budget).build(query, retrieved_context_chunks, history, schools)
+
+    def record_usage(self, usage) -> dict:
+        """
+        Keep the token usage of one call and add it to the token metrics
+        
+        Args:
+            usage: anthropic Usage object from the response
+        
+        Returns:
+            dict: input, output, cache read and cache creation token counts
+        """
+        self.last_usage = {
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+            "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        }
+        record_token_usage(self.last_usage)
+        return self.last_usage
+
     def generate_response(
         self, 
         query: str,
         retrieved_context_chunks,
-        max_context_tokens: int = 3500  # Prevent context overflow
+        history=None,
+        token_budget: int = PROMPT_TOKEN_BUDGET,  # Prevent context overflow
+        schools=None
     ) -> str:
         """
         Generate a contextual response using retrieved chunks
         
         Args:
             query (str): User's original query
-            k (int): Number of top similar chunks to retrieve
-            max_context_tokens (int): Maximum tokens for context
+            retrieved_context_chunks: Reranked chunks
+            history: Prior turns, sent as message turns
+            token_budget (int): Input tokens shared by chunks and history
+            schools: Schools whose static context goes into the cached prefix
         
         Returns:
             str: Generated response from LLM
         """
-        
-        # 2. Prepare context from chunks
-        context_chunks =[]
-        source = ""
-        for chunk in retrieved_context_chunks:
-            source = f"Source: {chunk["chunk"]['context']}\n{chunk["chunk"]['content']}" 
-            context_chunks.append(source) 
-        # context_chunks = [
-        #     f"[Source: {chunk['context']}]\n{chunk['content']}" 
-        #     for chunk in retrieved_context_chunks[0]["chunk"]
-        # ]
-        
-        # 3. Truncate context to prevent token overflow
-        
-        context = "\n\n".join(context_chunks)
-        # print(context)
-        context_tokens = self.count_tokens(context)
-        # pprint.pprint(f"{context_tokens} - {max_context_tokens}")
-        if float(context_tokens) > float(max_context_tokens):
-            context = self.truncate_context(context, max_context_tokens)
-        
-        # 4. Construct prompt with retrieved context
-        system_prompt = f"""You are an expert research assistant. 
-        Use the following contextual information to provide a comprehensive and precise answer to the user's query.
-        
-        Contextual Information:
-        {context}
-        
-        If the context does not directly answer the query, acknowledge this and provide the most relevant information available."""
+        system_prompt, messages = self.build_prompt(query, retrieved_context_chunks, history, token_budget, schools)
         
         # 5. Generate final response
         try:
-            response = self.anthropic_client.messages.create(
-                model="claude-3-haiku-20240307",
-                system=system_prompt,
-                max_tokens=500,
-                messages=[
-                    {
-                        "role": "user", 
-                        "content": query
-                    }
-                ]
-            )
+            with span("llm_generate"):
+                response = self.anthropic_client.messages.create(
+                    model=MODEL,
+                    system=system_prompt,
+                    max_tokens=MAX_RESPONSE_TOKENS,
+                    messages=messages
+                )
+            self.record_usage(response.usage)
             
             return response.content[0].text
         
         except Exception as e:
             return f"Error generating response: {str(e)}"
-    
-    def count_tokens(self, text: str) -> int:
+
+    async def agenerate_response(self, query: str, retrieved_context_chunks, history=None,
+                                 token_budget: int = PROMPT_TOKEN_BUDGET, schools=None) -> str:
         """
-        Estimate token count for a given text
+        Async generate_response using the AsyncAnthropic client
         
         Args:
-            text (str): Input text
+            query (str): User's original query
+            retrieved_context_chunks: Reranked chunks
+            history: Prior turns, sent as message turns
+            token_budget (int): Input tokens shared by chunks and history
+            schools: Schools whose static context goes into the cached prefix
         
         Returns:
-            int: Estimated token count
+            str: Generated response from LLM
         """
-        # Very basic token estimation
-        return len(text.split()) * 1.3  # Rough estimate
-    
-    def truncate_context(self, context: str, max_tokens: int) -> str:
+        system_prompt, messages = await asyncio.to_thread(
+            self.build_prompt, query, retrieved_context_chunks, history, token_budget, schools)
+        try:
+            with span("llm_generate"):
+                response = await self.async_client.messages.create(
+                    model=MODEL,
+                    system=system_prompt,
+                    max_tokens=MAX_RESPONSE_TOKENS,
+                    messages=messages
+                )
+            self.record_usage(response.usage)
+            return response.content[0].text
+        except Exception as e:
+            return f"Error generating response: {str(e)}"
+
+    async def astream_response(self, query: str, retrieved_context_chunks, history=None,
+                               token_budget: int = PROMPT_TOKEN_BUDGET, schools=None):
         """
-        Truncate context to fit within token limit
+        Stream the response text as Claude produces it
         
         Args:
-            context (str): Full context
-            max_tokens (int): Maximum allowed tokens
+            query (str): User's original query
+            retrieved_context_chunks: Reranked chunks
+            history: Prior turns, sent as message turns
+            token_budget (int): Input tokens shared by chunks and history
+            schools: Schools whose static context goes into the cached prefix
         
-        Returns:
-            str: Truncated context
+        Yields:
+            str: Text deltas
         """
-        chunks = context.split("\n\n")
-        print(chunks)
-        truncated_context = []
-        current_tokens = 0
-        
-        for chunk in chunks:
-            chunk_tokens = self.count_tokens(chunk)
-            
-            if current_tokens + chunk_tokens <= max_tokens:
-                truncated_context.append(chunk)
-                current_tokens += chunk_tokens
-            else:
-                break
-        
-        return "\n\n".join(truncated_context)
-
+        system_prompt, messages = await asyncio.to_thread(
+            self.build_prompt, query, retrieved_context_chunks, history, token_budget, schools)
+        start = time.perf_counter()
+        async with self.async_client.messages.stream(
+            model=MODEL,
+            system=system_prompt,
+            max_tokens=MAX_RESPONSE_TOKENS,
+            messages=messages
+        ) as stream:
+            first = True
+            async for text in stream.text_stream:
+                if first:
+                    record_stage("llm_first_token", time.perf_counter() - start)
+                    first = False
+                yield text
+            self.record_usage((await stream.get_final_message()).usage)
+            record_stage("llm_generate", time.perf_counter() - start)
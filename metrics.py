@@ -0,0 +1,204 @@
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency histogram buckets in seconds (Prometheus "le" bounds)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_METRIC = "school_rag_stage_seconds"
+TOKENS_METRIC = "school_rag_llm_tokens_total"
+REQUESTS_METRIC = "school_rag_requests_total"
+# Families rendered from the registered caches: (name, type, help)
+CACHE_FAMILIES = (
+    ("school_rag_cache_hits_total", "counter", "Cache lookups answered from the cache"),
+    ("school_rag_cache_misses_total", "counter", "Cache lookups that missed"),
+    ("school_rag_cache_hit_ratio", "gauge", "Hits / lookups since process start"),
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Minimal thread-safe Prometheus registry: counters, histograms and cache
+    hit/miss collectors, rendered in the text exposition format.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = OrderedDict()                   # name -> (type, help)
+        self._counters = {}                          # (name, labels) -> value
+        self._histograms = {}                        # (name, labels) -> [bucket counts..., sum, count]
+        self._buckets = {}                           # name -> bucket bounds
+        self._caches = OrderedDict()                 # cache name -> getter returning an object with hits/misses
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Tuple[float, ...] = None):
+        with self._lock:
+            self._help.setdefault(name, (kind, help_text))
+            if buckets is not None:
+                self._buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self._buckets[name]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            state = self._histograms.get(key)
+            if state is None:
+                state = self._histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def register_cache(self, name: str, getter: Callable[[], object]):
+        """
+        Export hits/misses of a cache; getter is called at scrape time so
+        caches replaced at runtime (e.g. on index reload) are followed.
+        """
+        with self._lock:
+            self._caches[name] = getter
+
+    def _cache_samples(self) -> Dict[str, List[str]]:
+        """
+        Samples per CACHE_FAMILIES metric, one per registered cache.
+        """
+        samples = {name: [] for name, _, _ in CACHE_FAMILIES}
+        for name, getter in list(self._caches.items()):
+            cache = getter()
+            if cache is None or not hasattr(cache, "hits"):
+                continue
+            hits = cache.hits + getattr(cache, "similar_hits", 0)
+            total = hits + cache.misses
+            labels = _label_text((("cache", name),))
+            samples["school_rag_cache_hits_total"].append(f"school_rag_cache_hits_total{labels} {hits}")
+            samples["school_rag_cache_misses_total"].append(f"school_rag_cache_misses_total{labels} {cache.misses}")
+            samples["school_rag_cache_hit_ratio"].append(
+                f"school_rag_cache_hit_ratio{labels} {hits / total if total else 0.0}")
+        return samples
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(state) for key, state in self._histograms.items()}
+            described = list(self._help.items())
+        lines = []
+        for name, (kind, help_text) in described:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_label_text(labels)} {value}")
+            elif kind == "histogram":
+                bounds = self._buckets[name]
+                for (metric, labels), state in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(bounds, state):
+                        lines.append(f"{name}_bucket{_label_text(labels + (('le', repr(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {state[-1]}")
+                    lines.append(f"{name}_sum{_label_text(labels)} {state[-2]}")
+                    lines.append(f"{name}_count{_label_text(labels)} {state[-1]}")
+        # Exposition format: each family's HELP/TYPE directly followed by its own samples
+        cache_samples = self._cache_samples()
+        for name, kind, help_text in CACHE_FAMILIES:
+            if cache_samples[name]:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(cache_samples[name])
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe(STAGE_METRIC, "histogram", "Time spent per pipeline stage", STAGE_BUCKETS)
+registry.describe(TOKENS_METRIC, "counter", "LLM tokens by kind (input, output, cache_read, cache_creation)")
+registry.describe(REQUESTS_METRIC, "counter", "HTTP requests by path and status")
+
+
+class Trace:
+    """
+    Stage timings of one request, reported back in the Server-Timing header.
+    """
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self._spans.append((stage, seconds))
+
+    def totals(self) -> Dict[str, float]:
+        """
+        Milliseconds per stage, summed over repeated spans, in first-seen order.
+        """
+        totals = OrderedDict()
+        with self._lock:
+            for stage, seconds in self._spans:
+                totals[stage] = totals.get(stage, 0.0) + seconds * 1000.0
+        return totals
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.totals().items())
+
+
+_current_trace = contextvars.ContextVar("school_rag_trace", default=None)
+
+
+def start_trace(trace_id: Optional[str] = None) -> Trace:
+    """
+    Start collecting spans for the current request (and the tasks and threads it spawns).
+    """
+    trace = Trace(trace_id)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def record_stage(stage: str, seconds: float):
+    registry.observe(STAGE_METRIC, seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Time a block as one pipeline stage (index_load, query_embed, vector_search,
+    rerank, prompt_build, llm_generate, ...).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_token_usage(usage: Dict[str, int]):
+    """
+    Count the token usage of one LLM call (as returned by LLMResponse.record_usage).
+    """
+    for kind, key in (("input", "input_tokens"), ("output", "output_tokens"),
+                      ("cache_read", "cache_read_input_tokens"),
+                      ("cache_creation", "cache_creation_input_tokens")):
+        registry.inc(TOKENS_METRIC, usage.get(key, 0), kind=kind)
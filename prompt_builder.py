@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import math
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+# Local tokenizer (a tokenizers JSON file); falls back to the hub copy, then to an estimate.
+# The published Claude tokenizer is the Claude 2 one: later models tokenize differently,
+# so its counts approximate what the API bills and budgets should leave some slack
+TOKENIZER_PATH = os.getenv("TOKENIZER_PATH", "./config/claude_tokenizer.json")
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME", "Xenova/claude-tokenizer")
+# Input tokens available for retrieved chunks plus conversation history
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "5000"))
+# Tokens the summary of dropped turns may use
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "200"))
+# Tokens prior turns may use, newest turn first, whatever the retrieved chunks
+# score; chunks fill the rest of the budget
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# Shortest prefix the API caches: 2048 tokens for Haiku models, 1024 for Sonnet and
+# Opus. A breakpoint on a shorter prefix caches nothing, so none is placed
+MIN_CACHEABLE_TOKENS = int(os.getenv("MIN_CACHEABLE_TOKENS", "2048"))
+# Fixed overhead the API adds per message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Per-school static context: SCHOOL_CONTEXT_DIR/<school>.md if present, otherwise
+# generated from the school's configured pages
+SCHOOL_CONFIG_PATH = os.getenv("SCHOOL_CONFIG_PATH", "./config/school_url.json")
+SCHOOL_CONTEXT_DIR = os.getenv("SCHOOL_CONTEXT_DIR", "./config/school_context")
+CACHE_CONTROL = {"type": "ephemeral"}
+# Appended to stored answers by MemoryChatAgent; not worth resending to the model
+SOURCES_MARKER = "\n\nSource URLs: "
+
+INSTRUCTIONS = """You are an expert research assistant.
+Use the contextual information sent with the user's latest message to provide a comprehensive and precise answer to the user's query.
+If the context does not directly answer the query, acknowledge this and provide the most relevant information available."""
+
+_tokenizer = None
+_tokenizer_loaded = False
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def load_tokenizer():
+    """
+    Load the tokenizer once. The hub fallback downloads on first use, so servers
+    call this at startup rather than on the first request.
+    """
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            from tokenizers import Tokenizer
+            if os.path.exists(TOKENIZER_PATH):
+                _tokenizer = Tokenizer.from_file(TOKENIZER_PATH)
+            else:
+                _tokenizer = Tokenizer.from_pretrained(TOKENIZER_NAME)
+        except Exception as e:
+            print(f"Tokenizer unavailable, estimating token counts: {e}")
+    return _tokenizer
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count of text with the Claude 2 tokenizer. Without one,
+    every word or punctuation mark counts one token per 4 characters, which errs high.
+    """
+    if not text:
+        return 0
+    tokenizer = load_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return sum(math.ceil(len(piece) / 4) for piece in _PIECE_RE.findall(text))
+
+
+@lru_cache(maxsize=None)
+def school_static_context(school: str) -> str:
+    """
+    Static description of a school, identical across requests so it can sit in
+    the cached prompt prefix.
+    """
+    path = os.path.join(SCHOOL_CONTEXT_DIR, f"{school}.md")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    try:
+        with open(SCHOOL_CONFIG_PATH, "r", encoding="utf-8") as f:
+            urls = next((entry["urls"] for entry in json.load(f) if entry["school"] == school), [])
+    except (OSError, ValueError):
+        urls = []
+    lines = [f"The question concerns {school}."]
+    if urls:
+        lines.append(f"Official {school} pages in the knowledge base include:")
+        lines.extend(f"- {url}" for url in urls)
+    return "\n".join(lines)
+
+
+def format_chunk(chunk: Dict[str, Any]) -> str:
+    return f"Source: {chunk['chunk']['context']}\n{chunk['chunk']['content']}"
+
+
+def strip_sources(ai_response: str) -> str:
+    return ai_response.split(SOURCES_MARKER, 1)[0]
+
+
+def summarize_turns(turns: List[Dict[str, str]], max_tokens: int) -> str:
+    """
+    Extractive summary of turns that no longer fit: the questions the user asked,
+    most recent last, trimmed from the oldest end to max_tokens.
+    """
+    lines = [f"- {turn['user'].strip()}" for turn in turns]
+    header = "Earlier in this conversation the user asked:"
+    while lines and count_tokens("\n".join([header] + lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join([header] + lines) if lines else ""
+
+
+class PromptBuilder:
+    """
+    Packs conversation turns and reranked chunks into a fixed token budget.
+
+    Turns are kept newest-first within their own budget, so the history never
+    has gaps and does not depend on how the chunks of this question score;
+    turns that do not fit are summarized. Chunks fill the rest by score.
+
+    The request is laid out for prompt caching: instructions and per-school
+    context, then prior turns, each closed by a cache breakpoint once the prefix
+    up to it is long enough to be cached. The summary of dropped turns, the
+    retrieved context and the question follow in the final message.
+    """
+    def __init__(self, token_budget: int = PROMPT_TOKEN_BUDGET, summary_budget: int = SUMMARY_TOKEN_BUDGET,
+                 instructions: str = INSTRUCTIONS, history_budget: int = HISTORY_TOKEN_BUDGET,
+                 min_cache_tokens: int = MIN_CACHEABLE_TOKENS):
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.instructions = instructions
+        self.history_budget = history_budget
+        self.min_cache_tokens = min_cache_tokens
+
+    def _turn_messages(self, turn: Dict[str, str]) -> List[Dict[str, str]]:
+        return [
+            {"role": "user", "content": turn["user"]},
+            {"role": "assistant", "content": strip_sources(turn["ai"])},
+        ]
+
+    def _turn_tokens(self, turn: Dict[str, str]) -> int:
+        return sum(count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in self._turn_messages(turn))
+
+    def pack(self, retrieved_context_chunks: List[Dict[str, Any]],
+             history: Optional[List[Dict[str, str]]] = None,
+             reserved_tokens: int = 0) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]], List[Dict[str, str]]]:
+        """
+        Choose what goes into the prompt.
+
+        :param retrieved_context_chunks: Reranked chunks ({"chunk": metadata, "score": ...})
+        :param history: Conversation turns [{"user": ..., "ai": ...}], oldest first
+        :param reserved_tokens: Budget already taken by fixed content (e.g. school context)
+        :return: Tuple of (chunks kept in score order, turns kept, turns dropped), turns oldest first
+        """
+        history = history or []
+        remaining = self.token_budget - reserved_tokens
+        turn_budget = min(self.history_budget, remaining)
+        turns_kept = 0
+        for turn in reversed(history):
+            tokens = self._turn_tokens(turn)
+            if tokens > turn_budget:
+                break
+            turn_budget -= tokens
+            remaining -= tokens
+            turns_kept += 1
+        split = len(history) - turns_kept
+        if split:
+            remaining -= self.summary_budget
+
+        order = sorted(range(len(retrieved_context_chunks)),
+                       key=lambda i: -float(retrieved_context_chunks[i].get("score", 0.0)))
+        chunks = []
+        for i in order:
+            tokens = count_tokens(format_chunk(retrieved_context_chunks[i]))
+            if tokens <= remaining:
+                chunks.append(retrieved_context_chunks[i])
+                remaining -= tokens
+        return chunks, history[split:], history[:split]
+
+    def build(self, query: str, retrieved_context_chunks: List[Dict[str, Any]],
+              history: Optional[List[Dict[str, str]]] = None,
+              schools: Optional[List[str]] = None) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Build the system blocks and message list for one answer.
+
+        :param query: The user's current question
+        :param retrieved_context_chunks: Reranked chunks
+        :param history: Conversation turns, oldest first
+        :param schools: Schools the question is about; their static context joins the cached prefix
+        :return: Tuple of (system content blocks, messages ending with context + question)
+        """
+        static = [school_static_context(school) for school in schools or []]
+        static_tokens = sum(count_tokens(text) for text in static)
+        chunks, turns, dropped = self.pack(retrieved_context_chunks, history, static_tokens)
+
+        system = [{"type": "text", "text": text} for text in [self.instructions] + static]
+        prefix_tokens = count_tokens(self.instructions) + static_tokens
+        if prefix_tokens >= self.min_cache_tokens:
+            system[-1]["cache_control"] = CACHE_CONTROL
+
+        messages = []
+        for turn in turns:
+            messages.extend(self._turn_messages(turn))
+            prefix_tokens += self._turn_tokens(turn)
+        if messages and prefix_tokens >= self.min_cache_tokens:
+            last = messages[-1]
+            last["content"] = [{"type": "text", "text": last["content"], "cache_control": CACHE_CONTROL}]
+
+        # The summary changes whenever another turn is dropped, so it stays out of the cached prefix
+        summary = summarize_turns(dropped, self.summary_budget) if dropped else ""
+        context = "\n\n".join(format_chunk(chunk) for chunk in chunks)
+        messages.append({"role": "user", "content": [
+            {"type": "text", "text": text} for text in [summary, f"Contextual Information:\n{context}", query] if text
+        ]})
+        return system, messages
@@ -0,0 +1,144 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict
+
+DEFAULT_CACHE_PATH = "./data/query_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 100_000
+# Per-process hot set in front of SQLite
+DEFAULT_MEMORY_ENTRIES = 1024
+# Eviction runs once every this many inserts rather than on each one
+EVICT_EVERY = 256
+# SQLite caps the number of bound parameters per statement
+LOOKUP_BATCH = 500
+
+
+def normalize_query(query: str) -> str:
+    """
+    Canonical form used as the cache key: lower-cased, whitespace collapsed.
+    """
+    return " ".join(query.lower().split())
+
+
+def query_key(model: str, query: str) -> str:
+    return hashlib.sha256(f"{model}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+class QueryEmbeddingCache:
+    """
+    Size-capped query embedding cache shared by every worker through SQLite,
+    with a small in-process LRU in front. The SQLite table is trimmed to
+    max_entries by least-recent access.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 memory_entries: int = DEFAULT_MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS queries ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS queries_by_access ON queries (last_access)")
+        return self._conn
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, queries: List[str]) -> Dict[str, np.ndarray]:
+        """
+        :return: Mapping of query (as given) -> cached vector, for the queries found
+        """
+        keys = {q: query_key(model, q) for q in queries}
+        found = {}
+        with self._lock:
+            missing = {}
+            for q, key in keys.items():
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[q] = self._memory[key]
+                else:
+                    missing.setdefault(key, []).append(q)
+            if missing:
+                conn = self._connect()
+                key_list = list(missing)
+                rows = []
+                for i in range(0, len(key_list), LOOKUP_BATCH):
+                    batch = key_list[i : i + LOOKUP_BATCH]
+                    rows.extend(conn.execute(
+                        f"SELECT key, vector FROM queries WHERE key IN ({','.join('?' * len(batch))})",
+                        batch,
+                    ).fetchall())
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector)
+                    for q in missing[key]:
+                        found[q] = vector
+                if rows:
+                    with conn:
+                        conn.executemany(
+                            "UPDATE queries SET last_access = ? WHERE key = ?",
+                            [(time.time(), key) for key, _ in rows],
+                        )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model: str, queries: List[str], vectors):
+        rows = []
+        with self._lock:
+            now = time.time()
+            for q, v in zip(queries, vectors):
+                key = query_key(model, q)
+                vector = np.asarray(v, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO queries (key, vector, last_access) VALUES (?, ?, ?)", rows
+                )
+            self._inserts += len(rows)
+            if self._inserts >= EVICT_EVERY:
+                self._inserts = 0
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        count = conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            with conn:
+                conn.execute(
+                    "DELETE FROM queries WHERE key IN"
+                    " (SELECT key FROM queries ORDER BY last_access LIMIT ?)",
+                    (overflow,),
+                )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
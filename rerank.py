@@ -1,9 +1,18 @@
 import cohere
-from typing import List, Dict, Any, Callable
+from typing import List, Dict, Any, Callable, Optional, Tuple
 import json
+import re
+import math
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
 from tqdm import tqdm
-import os, time
+import os
 import pprint
+from bm25 import tokenize as bm25_tokenize, K1 as BM25_K1, B as BM25_B
+from metrics import span
 
 def load_jsonl(file_path: str) -> List[Dict[str, Any]]:
     with open(file_path, 'r') as file:
@@ -15,34 +24,298 @@ def chunk_to_content(chunk: Dict[str, Any]) -> str:
     contextualized_content = chunk['metadata']['context']
     return f"{original_content}\n\nContext: {contextualized_content}" 
 
-def retrieve_rerank(query: str, db, k: int) -> List[Dict[str, Any]]:
-    co = cohere.Client( os.getenv("COHERE_API_KEY"))
+# Candidates sent to the reranker per requested result. Hybrid retrieval
+# recovers exact-token matches (course codes, dollar amounts) that dense search
+# alone only finds deep in the list, so it needs a much smaller pool.
+DENSE_CANDIDATE_MULTIPLIER = 10
+HYBRID_CANDIDATE_MULTIPLIER = 4
+# Adaptive pool: candidates whose dense similarity trails the k-th best by more
+# than this margin are not sent to the reranker, but at least
+# MIN_CANDIDATE_MULTIPLIER * k candidates always are
+ADAPTIVE_SCORE_MARGIN = float(os.getenv("RERANK_SCORE_MARGIN", "0.1"))
+MIN_CANDIDATE_MULTIPLIER = 2
+RERANK_MODEL = "rerank-english-v3.0"
+# "cohere" or "local" (CPU lexical scorer, no network)
+RERANKER = os.getenv("RERANKER", "cohere")
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+
+def school_filter_for_query(query: str, schools: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Build a {"school": [...]} filter for schools named in the query as whole words
+    (e.g. "TAMU tuition"), or None if no indexed school is mentioned.
+    """
+    named = [s for s in schools if re.search(rf"(?<!\w){re.escape(s)}(?!\w)", query, re.IGNORECASE)]
+    return {"school": named} if named else None
+
+
+class Reranker(ABC):
+    """
+    Reranker interface: score documents against a query and return the best
+    top_n as (document index, relevance score) pairs, best first.
+    """
+    name = "reranker"
+    # True when scores depend on the order documents are passed in (e.g. a rank prior)
+    order_sensitive = False
+
+    @abstractmethod
+    def rerank(self, query: str, documents: List[str], top_n: int) -> List[Tuple[int, float]]:
+        raise NotImplementedError
+
+    async def arerank(self, query: str, documents: List[str], top_n: int) -> List[Tuple[int, float]]:
+        return await asyncio.to_thread(self.rerank, query, documents, top_n)
+
+
+class CohereReranker(Reranker):
+    """
+    Cohere rerank with one sync and one async client per process, created on first use.
+    """
+    def __init__(self, api_key: Optional[str] = None, client=None, async_client=None, model: str = RERANK_MODEL):
+        self.api_key = api_key or os.getenv("COHERE_API_KEY")
+        self._client = client
+        self._async_client = async_client
+        self.model = model
+        self.name = f"cohere:{model}"
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = cohere.Client(self.api_key)
+            return self._client
+
+    @property
+    def async_client(self):
+        with self._lock:
+            if self._async_client is None:
+                self._async_client = cohere.AsyncClient(self.api_key)
+            return self._async_client
+
+    def rerank(self, query: str, documents: List[str], top_n: int) -> List[Tuple[int, float]]:
+        response = self.client.rerank(model=self.model, query=query, documents=documents, top_n=top_n)
+        return [(r.index, r.relevance_score) for r in response.results]
+
+    async def arerank(self, query: str, documents: List[str], top_n: int) -> List[Tuple[int, float]]:
+        response = await self.async_client.rerank(model=self.model, query=query, documents=documents, top_n=top_n)
+        return [(r.index, r.relevance_score) for r in response.results]
+
+
+class LexicalReranker(Reranker):
+    """
+    CPU-only stand-in for offline and dev use. Scores each candidate from BM25
+    over the candidate set, query term coverage, query bigrams found in order,
+    and the first-stage rank; scores are in [0, 1].
+    """
+    name = "local:lexical"
+    order_sensitive = True
+    WEIGHTS = (0.5, 0.25, 0.15, 0.1)     # bm25, coverage, phrase, first-stage rank
+
+    def rerank(self, query: str, documents: List[str], top_n: int) -> List[Tuple[int, float]]:
+        query_terms = list(dict.fromkeys(bm25_tokenize(query)))
+        if not documents:
+            return []
+        if not query_terms:
+            return [(i, 0.0) for i in range(min(top_n, len(documents)))]
+        terms = set(query_terms)
+        bigrams = set(zip(query_terms, query_terms[1:]))
+        docs = [bm25_tokenize(d) for d in documents]
+        avg_len = max(sum(len(d) for d in docs) / len(docs), 1.0)
+        df = Counter(t for d in docs for t in set(d) & terms)
+
+        raw = []
+        for rank, tokens in enumerate(docs):
+            tf = Counter(t for t in tokens if t in terms)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avg_len)
+            bm = sum(
+                math.log(1 + (len(docs) - df[t] + 0.5) / (df[t] + 0.5)) * n * (BM25_K1 + 1) / (n + norm)
+                for t, n in tf.items()
+            )
+            coverage = len(tf) / len(terms)
+            phrase = len(bigrams & set(zip(tokens, tokens[1:]))) / len(bigrams) if bigrams else 0.0
+            raw.append((bm, coverage, phrase, 1.0 / (1 + rank)))
+
+        best_bm = max(r[0] for r in raw) or 1.0
+        w_bm, w_cov, w_phrase, w_rank = self.WEIGHTS
+        scores = [w_bm * bm / best_bm + w_cov * cov + w_phrase * ph + w_rank * prior
+                  for bm, cov, ph, prior in raw]
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])[:top_n]
+        return [(i, scores[i]) for i in order]
+
+
+class CachedReranker(Reranker):
+    """
+    In-process LRU in front of another reranker, keyed by the query and a hash
+    of the candidate set. Hits are mapped back by document content, so the
+    same candidates in a different order still hit, unless the inner reranker
+    is order_sensitive: then the candidate order is part of the key.
+    """
+    def __init__(self, inner: Reranker, max_entries: int = RERANK_CACHE_SIZE):
+        self.inner = inner
+        self.name = inner.name
+        self.order_sensitive = inner.order_sensitive
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, query: str, doc_hashes: List[str], top_n: int) -> str:
+        candidates = doc_hashes if self.inner.order_sensitive else sorted(doc_hashes)
+        candidate_set = hashlib.sha256("\0".join(candidates).encode("utf-8")).hexdigest()
+        return f"{self.name}\0{top_n}\0{' '.join(query.lower().split())}\0{candidate_set}"
+
+    def _lookup(self, key: str, doc_hashes: List[str]) -> Optional[List[Tuple[int, float]]]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Identical documents share a hash; hand out their indices in order
+        positions = {}
+        for i, h in enumerate(doc_hashes):
+            positions.setdefault(h, []).append(i)
+        taken = Counter()
+        results = []
+        for h, score in cached:
+            results.append((positions[h][taken[h]], score))
+            taken[h] += 1
+        return results
+
+    def _store(self, key: str, doc_hashes: List[str], results: List[Tuple[int, float]]):
+        with self._lock:
+            self._entries[key] = [(doc_hashes[i], score) for i, score in results]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def rerank(self, query: str, documents: List[str], top_n: int) -> List[Tuple[int, float]]:
+        doc_hashes = [hashlib.sha1(d.encode("utf-8")).hexdigest() for d in documents]
+        key = self._key(query, doc_hashes, top_n)
+        cached = self._lookup(key, doc_hashes)
+        if cached is not None:
+            return cached
+        results = self.inner.rerank(query, documents, top_n)
+        self._store(key, doc_hashes, results)
+        return results
+
+    async def arerank(self, query: str, documents: List[str], top_n: int) -> List[Tuple[int, float]]:
+        doc_hashes = [hashlib.sha1(d.encode("utf-8")).hexdigest() for d in documents]
+        key = self._key(query, doc_hashes, top_n)
+        cached = self._lookup(key, doc_hashes)
+        if cached is not None:
+            return cached
+        results = await self.inner.arerank(query, documents, top_n)
+        self._store(key, doc_hashes, results)
+        return results
+
+
+def make_reranker(kind: str = RERANKER, cohere_client=None, cohere_async_client=None,
+                  cache_size: int = RERANK_CACHE_SIZE) -> Reranker:
+    """
+    Build a cached reranker: "cohere" (optionally around existing clients) or "local".
+    """
+    if kind == "local":
+        inner = LexicalReranker()
+    elif kind == "cohere":
+        inner = CohereReranker(client=cohere_client, async_client=cohere_async_client)
+    else:
+        raise ValueError(f"Unknown reranker {kind!r}; expected 'cohere' or 'local'")
+    return CachedReranker(inner, cache_size) if cache_size else inner
+
+
+_default_reranker = None
+_default_reranker_lock = threading.Lock()
+
+def default_reranker() -> Reranker:
+    """
+    Process-wide reranker chosen by the RERANKER environment variable.
+    """
+    global _default_reranker
+    with _default_reranker_lock:
+        if _default_reranker is None:
+            _default_reranker = make_reranker()
+        return _default_reranker
+
+
+def adaptive_candidates(results: List[Dict[str, Any]], k: int,
+                        margin: float = ADAPTIVE_SCORE_MARGIN) -> List[Dict[str, Any]]:
+    """
+    Shrink the candidate pool when dense scores are clearly separated: keep the
+    first MIN_CANDIDATE_MULTIPLIER * k results, then only those within margin of
+    the k-th best similarity. Lexical-only hybrid hits (similarity None) are kept.
+    """
+    min_keep = MIN_CANDIDATE_MULTIPLIER * k
+    if len(results) <= min_keep:
+        return results
+    similarities = sorted((r["similarity"] for r in results if r.get("similarity") is not None), reverse=True)
+    if len(similarities) < k:
+        return results
+    threshold = similarities[k - 1] - margin
+    return results[:min_keep] + [
+        r for r in results[min_keep:] if r.get("similarity") is None or r["similarity"] >= threshold
+    ]
+
+
+def retrieve_rerank(query: str, db, k: int, hybrid: bool = True, filter: Optional[Dict[str, Any]] = None,
+                    reranker: Optional[Reranker] = None) -> List[Dict[str, Any]]:
+    """
+    Retrieve candidates from db and rerank them down to k.
+
+    :param reranker: Reranker to use (default_reranker() if omitted)
+    """
+    reranker = reranker or default_reranker()
     
     # Retrieve more results than we normally would
-    semantic_results = db.search(query, k=k*10)
+    if hybrid:
+        semantic_results = db.hybrid_search(query, k=k*HYBRID_CANDIDATE_MULTIPLIER, filter=filter)
+    else:
+        semantic_results = db.search(query, k=k*DENSE_CANDIDATE_MULTIPLIER, filter=filter)
+    semantic_results = adaptive_candidates(semantic_results, k)
+    if not semantic_results:
+        return []
     
     # Extract documents for reranking, using the contextualized content
     documents = [chunk_to_content(res) for res in semantic_results]
+    with span("rerank"):
+        ranked = reranker.rerank(query, documents, k)
+    return rerank_results(ranked, semantic_results)
 
-    response = co.rerank(
-        model="rerank-english-v3.0",
-        query=query,
-        documents=documents,
-        top_n=k
-    )
-    time.sleep(0.1)
-    
+def rerank_results(ranked: List[Tuple[int, float]], semantic_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     final_results = []
-    for r in response.results:
-        original_result = semantic_results[r.index]
+    for index, score in ranked:
+        original_result = semantic_results[index]
         
         final_results.append({
             "chunk": original_result['metadata'],
-            "score": r.relevance_score
+            "score": score
         })
     # pprint.pprint(final_results[1])
     return final_results
 
+async def aretrieve_rerank(query: str, db, k: int, reranker: Optional[Reranker] = None, hybrid: bool = True,
+                           filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Async retrieve_rerank: awaits the voyage embed and the rerank instead of
+    blocking the event loop.
+
+    :param reranker: Reranker to use (default_reranker() if omitted)
+    """
+    reranker = reranker or default_reranker()
+    if hybrid:
+        semantic_results = await db.ahybrid_search(query, k=k*HYBRID_CANDIDATE_MULTIPLIER, filter=filter)
+    else:
+        semantic_results = await db.asearch(query, k=k*DENSE_CANDIDATE_MULTIPLIER, filter=filter)
+    semantic_results = adaptive_candidates(semantic_results, k)
+    if not semantic_results:
+        return []
+
+    documents = [chunk_to_content(res) for res in semantic_results]
+    with span("rerank"):
+        ranked = await reranker.arerank(query, documents, k)
+    return rerank_results(ranked, semantic_results)
+
 def evaluate_retrieval_rerank(queries: List[Dict[str, Any]], retrieval_function: Callable, db, k: int = 20) -> Dict[str, float]:
     total_score = 0
     total_queries = len(queries)
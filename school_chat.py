@@ -1,5 +1,6 @@
 import os
 import sys
+import asyncio
 from anthropic import Anthropic
 import json
 from vector_db_schools import *
@@ -10,18 +11,34 @@ from dotenv import load_dotenv
 load_dotenv()
 
 class MemoryChatAgent:
-    def __init__(self,  max_memory_length:int=10):
+    def __init__(self,  max_memory_length:int=10, client=None, base_db=None, async_client=None, reranker=None,
+                 answer_cache=None, session_store=None, session_id=None, conversation_history=None):
         """
         Initialize the chat agent with API key and memory management.
         
         :param api_key: Anthropic API key
         :param max_memory_length: Maximum number of previous interactions to remember
+        :param client: Optional shared Anthropic client (created when omitted)
+        :param base_db: Optional already-loaded VectorDB shared across agents
+        :param async_client: Shared AsyncAnthropic client for the async methods
+        :param reranker: Shared Reranker (rerank.default_reranker() when omitted)
+        :param answer_cache: Shared SemanticAnswerCache for first-turn questions
+        :param session_store: Shared SessionStore; history is loaded from and saved to it
+        :param session_id: Conversation this agent serves (required with session_store)
+        :param conversation_history: History already read from session_store (async callers
+                                     read it off the event loop); read here when omitted
         """
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-        self.conversation_history = []
-        self.max_memory_length = 10
-        self.base_db = VectorDB("school_db")
-        print(self.client)
+        self.client = client or Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.async_client = async_client
+        self.reranker = reranker if reranker is not None else default_reranker()
+        self.answer_cache = answer_cache
+        self.session_store = session_store
+        self.session_id = session_id
+        if conversation_history is None:
+            conversation_history = session_store.get_history(session_id) if session_store is not None else []
+        self.conversation_history = conversation_history
+        self.max_memory_length = max_memory_length
+        self.base_db = base_db if base_db is not None else VectorDB("school_db")
 
     
     def _add_to_memory(self, user_message, ai_response):
@@ -31,7 +48,19 @@ class MemoryChatAgent:
         :param user_message: Message from the user
         :param ai_response: Response from the AI
         """
-        
+        self._remember_turn(user_message, ai_response)
+        if self.session_store is not None:
+            self.session_store.append_turn(self.session_id, user_message, ai_response)
+
+    async def _aadd_to_memory(self, user_message, ai_response):
+        """
+        _add_to_memory for the async paths: the session store write runs on a worker thread.
+        """
+        self._remember_turn(user_message, ai_response)
+        if self.session_store is not None:
+            await asyncio.to_thread(self.session_store.append_turn, self.session_id, user_message, ai_response)
+
+    def _remember_turn(self, user_message, ai_response):
         # Add the interaction to memory
         self.conversation_history.append({
             'user': user_message,
@@ -42,45 +71,11 @@ class MemoryChatAgent:
         if len(self.conversation_history) > self.max_memory_length:
             self.conversation_history.pop(0)
     
-    def _prepare_context(self):
-        """
-        Prepare context from conversation history for API call.
-        
-        :return: List of message dictionaries for API context
-        """
-        context = []
-        for interaction in self.conversation_history:
-            context.append({"role": "user", "content": interaction['user']})
-            context.append({"role": "assistant", "content": interaction['ai']})
-        return context
-    
-    
-    def dicts_to_string(self, messages):
-        """
-        Converts a list of dictionaries, each with 'role' and 'content' keys, to a string.
-
-        Args:
-            data_list: A list of dictionaries.
-
-        Returns:
-            A formatted string representation of the list of dictionaries, or None if the input is invalid.
-        """
-        if not isinstance(messages, list):
-            return None  # Return None if input is not a list
-
-        result_strings = []
-        for data_dict in messages:
-            if 'role' in data_dict and 'content' in data_dict:
-                result_strings.append(f"Role: {data_dict['role']}, Content: {data_dict['content']}")
-            else:
-                return None #Return None if any dictionary is invalid.
-
-        return "\n".join(result_strings) #Join the strings with newlines.
     def get_source_urls(self,retreived_chunks):
         source_urls = []
         source = "Source URLs: "
         for chunk in retreived_chunks:
-            source_urls.append(chunk['chunk']['source_url'])
+            source_urls.extend(chunk_source_urls(chunk['chunk']))
         unique_urls = set(source_urls)
         for u in unique_urls:
             source += f"\n{u}" 
@@ -98,15 +93,10 @@ class MemoryChatAgent:
             llm = LLMResponse(self.client)
             
             
-            # Prepare the full context including conversation history
-            messages = self._prepare_context() + [
-                {"role": "user", "content": user_message}
-            ]
-            query = self.dicts_to_string(messages)
-            print("API" + query)
-            reranked_chunks = retrieve_rerank(user_message,self.base_db,5)
+            school_filter = school_filter_for_query(user_message, self.base_db.filter_values("school"))
+            reranked_chunks = retrieve_rerank(user_message,self.base_db,5, filter=school_filter, reranker=self.reranker)
             
-            ai_response = f"{llm.generate_response(query , reranked_chunks)}\n\n{self.get_source_urls(reranked_chunks)}"  
+            ai_response = f"{llm.generate_response(user_message, reranked_chunks, self.conversation_history, schools=self._session_schools(user_message))}\n\n{self.get_source_urls(reranked_chunks)}"  
             # pprint.pprint(self.get_source_urls(reranked_chunks))
 
             self._add_to_memory(user_message, ai_response)
@@ -117,6 +107,96 @@ class MemoryChatAgent:
             return f"An error occurred: {str(e)}"
     
 
+    def _unique_source_urls(self, retreived_chunks):
+        return list(dict.fromkeys(url for chunk in retreived_chunks for url in chunk_source_urls(chunk['chunk'])))
+
+    def _session_schools(self, user_message):
+        """
+        Schools named in the message, else in the latest earlier turn that named one;
+        their static context forms the cached prompt prefix of the session.
+        """
+        schools = self.base_db.filter_values("school")
+        for message in [user_message] + [turn['user'] for turn in reversed(self.conversation_history)]:
+            school_filter = school_filter_for_query(message, schools)
+            if school_filter:
+                return school_filter["school"]
+        return None
+
+    async def _aretrieve(self, user_message, school_filter):
+        return await aretrieve_rerank(user_message, self.base_db, 5, reranker=self.reranker, filter=school_filter)
+
+    async def _acached_answer(self, user_message, school_filter):
+        """
+        Look the question up in the semantic answer cache, among answers retrieved
+        with the same school filter. Only questions without prior turns are
+        cacheable, since history changes the answer.
+
+        :return: Tuple of (query embedding or None, cached entry or None)
+        """
+        if self.answer_cache is None or self.conversation_history:
+            return None, None
+        query_vector = await self.base_db.aembed_query(user_message)
+        return query_vector, self.answer_cache.get(query_vector, self.base_db.index_version, school_filter)
+
+    def _cache_answer(self, query_vector, school_filter, ai_response, sources):
+        if query_vector is not None:
+            self.answer_cache.put(query_vector, {"response": ai_response, "sources": sources},
+                                  self.base_db.index_version, school_filter)
+
+    async def aapi_chat(self, user_message):
+        """
+        Async api_chat: retrieval, rerank and generation never block the event loop.
+        
+        :param user_message: Message from the user
+        :return: AI's response
+        """
+        try:
+            school_filter = school_filter_for_query(user_message, self.base_db.filter_values("school"))
+            query_vector, cached = await self._acached_answer(user_message, school_filter)
+            if cached is not None:
+                await self._aadd_to_memory(user_message, cached["response"])
+                return cached["response"]
+
+            llm = LLMResponse(self.client, self.async_client)
+            reranked_chunks = await self._aretrieve(user_message, school_filter)
+            answer = await llm.agenerate_response(user_message, reranked_chunks, self.conversation_history,
+                                                 schools=self._session_schools(user_message))
+            ai_response = f"{answer}\n\n{self.get_source_urls(reranked_chunks)}"
+            await self._aadd_to_memory(user_message, ai_response)
+            self._cache_answer(query_vector, school_filter, ai_response, self._unique_source_urls(reranked_chunks))
+            return ai_response
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
+
+    async def astream_chat(self, user_message):
+        """
+        Stream a response: yields ("sources", [urls]) once retrieval is done, then
+        ("token", text) for each piece of the answer as Claude produces it.
+        
+        :param user_message: Message from the user
+        """
+        school_filter = school_filter_for_query(user_message, self.base_db.filter_values("school"))
+        query_vector, cached = await self._acached_answer(user_message, school_filter)
+        if cached is not None:
+            yield "sources", cached["sources"]
+            yield "token", cached["response"]
+            await self._aadd_to_memory(user_message, cached["response"])
+            return
+
+        llm = LLMResponse(self.client, self.async_client)
+        reranked_chunks = await self._aretrieve(user_message, school_filter)
+        sources = self._unique_source_urls(reranked_chunks)
+        yield "sources", sources
+
+        parts = []
+        async for text in llm.astream_response(user_message, reranked_chunks, self.conversation_history,
+                                              schools=self._session_schools(user_message)):
+            parts.append(text)
+            yield "token", text
+        ai_response = f"{''.join(parts)}\n\n{self.get_source_urls(reranked_chunks)}"
+        await self._aadd_to_memory(user_message, ai_response)
+        self._cache_answer(query_vector, school_filter, ai_response, sources)
+
     def chat(self, user_message, chat_client):
         """
         Generate a response using the Anthropic API with conversation context.
@@ -126,14 +206,9 @@ class MemoryChatAgent:
         """
         try:
 
-            # Prepare the full context including conversation history
-            messages = self._prepare_context() + [
-                {"role": "user", "content": user_message}
-            ]
-            query = self.dicts_to_string(messages)
-            
-            reranked_chunks = retrieve_rerank(user_message,self.base_db,5)
-            ai_response = f"{chat_client.generate_response(query , reranked_chunks)}\n\n{self.get_source_urls(reranked_chunks)}"  
+            school_filter = school_filter_for_query(user_message, self.base_db.filter_values("school"))
+            reranked_chunks = retrieve_rerank(user_message,self.base_db,5, filter=school_filter, reranker=self.reranker)
+            ai_response = f"{chat_client.generate_response(user_message, reranked_chunks, self.conversation_history, schools=self._session_schools(user_message))}\n\n{self.get_source_urls(reranked_chunks)}"  
             # pprint.pprint(self.get_source_urls(reranked_chunks))
 
             self._add_to_memory(user_message, ai_response)
@@ -166,11 +241,8 @@ class MemoryChatAgent:
 
 # Example usage
 def main():
-    # Replace with your actual Anthropic API key
-    API_KEY = os.getenv('ANTHROPIC_API_KEY')
-    
-    # Initialize the chat agent
-    chat_agent = MemoryChatAgent(API_KEY)
+    # Initialize the chat agent (its Anthropic client reads ANTHROPIC_API_KEY)
+    chat_agent = MemoryChatAgent()
     if chat_agent.base_db.load_vector_db():
             print("Vector DB loaded successfully.")
     else:
@@ -1,49 +1,252 @@
-from fastapi import FastAPI, HTTPException
+import os
+import json
+import asyncio
+from contextlib import asynccontextmanager
+import time
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
+from anthropic import Anthropic, AsyncAnthropic
+import cohere
+import voyageai
 from school_chat import MemoryChatAgent
+from answer_cache import SemanticAnswerCache
+from query_cache import QueryEmbeddingCache
+from session_store import SessionStore, new_session_id
+from metrics import registry, start_trace, current_trace, record_stage, REQUESTS_METRIC
 from vector_db_schools import *
 from rerank import *
 from llm_response import *
+from prompt_builder import load_tokenizer
 
-app = FastAPI()
+# How often (seconds) the background task checks the index file for changes
+INDEX_POLL_SECONDS = float(os.getenv("INDEX_POLL_SECONDS", "30"))
+# How often (seconds) expired chat sessions are purged from the session store
+SESSION_PURGE_SECONDS = float(os.getenv("SESSION_PURGE_SECONDS", "3600"))
+
+
+class SharedResources:
+    """
+    Process-wide clients and vector index, loaded once at startup and
+    shared read-only by every request.
+    """
+    def __init__(self):
+        self.anthropic_client = None
+        self.async_anthropic_client = None
+        self.voyage_client = None
+        self.async_voyage_client = None
+        self.reranker = None
+        # Survives index reloads; SQLite-backed so all workers share hits
+        self.query_cache = QueryEmbeddingCache(max_entries=int(os.getenv("QUERY_CACHE_SIZE", "100000")))
+        self.answer_cache = SemanticAnswerCache(
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "2048")),
+            ttl_seconds=float(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600))),
+            similarity_threshold=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95")),
+        )
+        self.sessions = SessionStore(
+            path=os.getenv("SESSION_STORE_PATH", "./data/sessions.sqlite"),
+            ttl_seconds=float(os.getenv("SESSION_TTL", str(24 * 3600))),
+            memory_sessions=int(os.getenv("SESSION_MEMORY_SIZE", "4096")),
+        )
+        self.base_db = None
+        self.index_mtime = None
+
+    def load_db(self):
+        """
+        Load a fresh VectorDB from disk using the shared voyage client.
+
+        :return: Tuple of (loaded VectorDB, index file mtime)
+        """
+        db = VectorDB("school_db", voyage_client=self.voyage_client, async_voyage_client=self.async_voyage_client,
+                      query_cache=self.query_cache)
+        mtime = index_mtime(db.index_marker_path)
+        if not db.load_vector_db():
+            raise RuntimeError(f"Failed to load Vector DB from {db.db_path}")
+        return db, mtime
+
+
+def index_mtime(marker_path):
+    """
+    Return the modification time of the index marker file, or None if it is missing.
+    """
+    try:
+        return os.stat(marker_path).st_mtime
+    except OSError:
+        return None
+
+
+resources = SharedResources()
+
+
+async def watch_index(shared: SharedResources, interval: float = INDEX_POLL_SECONDS):
+    """
+    Poll the index file and swap in a freshly loaded VectorDB when it changes.
+    The old instance keeps serving in-flight requests until they finish.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        mtime = index_mtime(shared.base_db.index_marker_path)
+        if mtime is None or mtime == shared.index_mtime:
+            continue
+        try:
+            new_db, new_mtime = await asyncio.to_thread(shared.load_db)
+        except Exception as e:
+            print(f"Index reload failed, keeping current index: {e}")
+            continue
+        shared.base_db = new_db
+        shared.index_mtime = new_mtime
+        print(f"Vector DB reloaded ({len(new_db.metadata)} chunks).")
+
+
+async def purge_sessions(shared: SharedResources, interval: float = SESSION_PURGE_SECONDS):
+    """
+    Periodically delete chat sessions that have been idle past their TTL.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(shared.sessions.purge_expired)
+        except Exception as e:
+            print(f"Session purge failed: {e}")
+            continue
+        if removed:
+            print(f"Purged {removed} expired chat sessions.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    resources.anthropic_client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    resources.async_anthropic_client = AsyncAnthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+    resources.voyage_client = voyageai.Client(api_key=os.getenv("VOYAGE_API_KEY"))
+    resources.async_voyage_client = voyageai.AsyncClient(api_key=os.getenv("VOYAGE_API_KEY"))
+    resources.reranker = make_reranker(cohere_async_client=cohere.AsyncClient(os.getenv("COHERE_API_KEY")))
+    resources.base_db, resources.index_mtime = await asyncio.to_thread(resources.load_db)
+    # Token counting runs on every prompt; load (or download) the tokenizer before serving
+    await asyncio.to_thread(load_tokenizer)
+    print("Vector DB loaded successfully.")
+    watcher = asyncio.create_task(watch_index(resources))
+    purger = asyncio.create_task(purge_sessions(resources))
+    try:
+        yield
+    finally:
+        watcher.cancel()
+        purger.cancel()
+        resources.sessions.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+registry.register_cache("query_embedding", lambda: resources.query_cache)
+registry.register_cache("answer", lambda: resources.answer_cache)
+registry.register_cache("rerank", lambda: resources.reranker)
+registry.register_cache("chunk_embedding", lambda: resources.base_db.embedding_cache if resources.base_db else None)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Give every request a trace (X-Request-ID, taken from the client when sent)
+    and report its stage timings in the Server-Timing header.
+    """
+    trace = start_trace(request.headers.get("X-Request-ID"))
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        record_stage("request", time.perf_counter() - start)
+        registry.inc(REQUESTS_METRIC, path=request.url.path, status=str(status))
+    response.headers["X-Request-ID"] = trace.trace_id
+    response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus text exposition: stage latency histograms, LLM token counters,
+    request counts and cache hit rates.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 class QueryRequest(BaseModel):
     query: str
+    # Omit to start a new conversation; pass the returned id back for follow-up turns
+    session_id: Optional[str] = None
+
 
+async def new_chat_agent(session_id: str):
+    """
+    Cheap per-request agent: the session's history comes from the shared session
+    store (read on a worker thread) while the clients and the loaded index are
+    shared process-wide. Call with the session lock held so turns of one
+    conversation stay ordered.
+    """
+    history = await asyncio.to_thread(resources.sessions.get_history, session_id)
+    return MemoryChatAgent(
+        client=resources.anthropic_client,
+        base_db=resources.base_db,
+        async_client=resources.async_anthropic_client,
+        reranker=resources.reranker,
+        answer_cache=resources.answer_cache,
+        session_store=resources.sessions,
+        session_id=session_id,
+        conversation_history=history,
+    )
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-# Assume qa_chain is already defined from the previous step
 
 @app.post("/chat")
 async def chat(query_request: QueryRequest):
     try:
-        print (query_request.query)
-        chat_agent = MemoryChatAgent()
-        print("Chat Agent initialized")
-        print(dir(chat_agent))
-        if chat_agent.base_db.load_vector_db():
-            print("Vector DB loaded successfully.")
-        else:
-            print("Failed to load Vector DB.")
-            sys.exit(1)
-        
-        
-        response = chat_agent.api_chat(query_request.query)
+        session_id = query_request.session_id or new_session_id()
+        async with resources.sessions.lock(session_id):
+            chat_agent = await new_chat_agent(session_id)
+            response = await chat_agent.aapi_chat(query_request.query)
         return {
-            "answer": response
+            "answer": response,
+            "session_id": session_id
         }
-            # print("AI:", response)
-
-
-        # # Get response from RAG pipeline
-        # response = qa_chain({"query": query_request.query})
-        # return {
-        #     "answer": response["result"],
-        #     "source_documents": [doc.page_content for doc in response["source_documents"]]
-        # }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@app.post("/chat/stream")
+async def chat_stream(query_request: QueryRequest):
+    """
+    Server-sent events: one "sources" event as soon as retrieval finishes, then
+    "token" events as Claude generates, then "done" (or "error"). The "done"
+    event carries the session_id to send with the next turn and the stage
+    timings, since the Server-Timing header is sent before the answer exists.
+    """
+    session_id = query_request.session_id or new_session_id()
+    trace = current_trace()
+
+    async def events():
+        try:
+            async with resources.sessions.lock(session_id):
+                chat_agent = await new_chat_agent(session_id)
+                async for kind, payload in chat_agent.astream_chat(query_request.query):
+                    yield sse_event(kind, payload)
+            yield sse_event("done", {
+                "session_id": session_id,
+                "trace_id": trace.trace_id if trace else None,
+                "timing_ms": trace.totals() if trace else {},
+            })
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
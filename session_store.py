@@ -0,0 +1,166 @@
+import os
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from typing import List, Dict
+
+DEFAULT_STORE_PATH = "./data/sessions.sqlite"
+DEFAULT_TTL_SECONDS = 24 * 3600
+# Sessions whose history is kept in process memory
+DEFAULT_MEMORY_SESSIONS = 4096
+# Turns kept per session (matches MemoryChatAgent.max_memory_length)
+DEFAULT_MAX_TURNS = 10
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class SessionStore:
+    """
+    Conversation history per session_id: an in-process LRU of recent sessions in
+    front of SQLite. Each turn is a single row insert, so a busy session never
+    rewrites anyone else's history. Several worker processes may share the
+    database: a cached session is used only while its last turn number still
+    matches SQLite, otherwise it is re-read. Sessions idle for longer than ttl_seconds
+    read as empty and are removed by purge_expired().
+    """
+    def __init__(self, path: str = DEFAULT_STORE_PATH, ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 memory_sessions: int = DEFAULT_MEMORY_SESSIONS, max_turns: int = DEFAULT_MAX_TURNS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.memory_sessions = memory_sessions
+        self.max_turns = max_turns
+        self._memory = OrderedDict()            # session_id -> (history, updated_at, last turn number)
+        self._locks = weakref.WeakValueDictionary()
+        self._conn = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                " session_id TEXT NOT NULL, turn INTEGER NOT NULL, user TEXT NOT NULL, ai TEXT NOT NULL,"
+                " created_at REAL NOT NULL, PRIMARY KEY (session_id, turn))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS turns_by_time ON turns (created_at)")
+        return self._conn
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """
+        Per-session lock so concurrent requests of one session run their turns in order
+        within this process. It does not order requests across worker processes; those
+        still see each other's turns through SQLite (see get_history and append_turn).
+        The lock lives as long as someone holds a reference to it.
+        """
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[session_id] = lock
+        return lock
+
+    def _remember(self, session_id: str, history: List[Dict[str, str]], updated_at: float, last_turn: int):
+        self._memory[session_id] = (history, updated_at, last_turn)
+        self._memory.move_to_end(session_id)
+        while len(self._memory) > self.memory_sessions:
+            self._memory.popitem(last=False)
+
+    def _load(self, conn: sqlite3.Connection, session_id: str, now: float):
+        """
+        Read the session from SQLite into memory.
+
+        :return: Tuple of (history, updated_at, last turn number)
+        """
+        rows = conn.execute(
+            "SELECT user, ai, created_at, turn FROM turns WHERE session_id = ? AND created_at >= ?"
+            " ORDER BY turn DESC LIMIT ?",
+            (session_id, now - self.ttl_seconds, self.max_turns),
+        ).fetchall()
+        history = [{"user": user, "ai": ai} for user, ai, _, _ in reversed(rows)]
+        updated_at, last_turn = (rows[0][2], rows[0][3]) if rows else (now, self._last_turn(conn, session_id))
+        self._remember(session_id, history, updated_at, last_turn)
+        return history, updated_at, last_turn
+
+    @staticmethod
+    def _last_turn(conn: sqlite3.Connection, session_id: str) -> int:
+        return conn.execute("SELECT COALESCE(MAX(turn), 0) FROM turns WHERE session_id = ?",
+                            (session_id,)).fetchone()[0]
+
+    def _history(self, conn: sqlite3.Connection, session_id: str, now: float):
+        """
+        The session from memory if no other process has added a turn since, else from SQLite.
+        """
+        cached = self._memory.get(session_id)
+        # Other workers share the database: the cached copy is only good while
+        # the session's last turn number in SQLite is still the one we saw
+        if cached is not None and cached[2] == self._last_turn(conn, session_id):
+            self._memory.move_to_end(session_id)
+            return cached
+        return self._load(conn, session_id, now)
+
+    def get_history(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Last max_turns turns of the session as [{"user": ..., "ai": ...}], oldest first.
+        """
+        now = time.time()
+        with self._db_lock:
+            history, updated_at, _ = self._history(self._connect(), session_id, now)
+            if now - updated_at > self.ttl_seconds:
+                return []
+            return list(history)
+
+    def append_turn(self, session_id: str, user_message: str, ai_response: str):
+        """
+        Record one turn and trim the session to its last max_turns turns. The write
+        transaction is taken up front so workers appending to one session get
+        distinct turn numbers.
+        """
+        now = time.time()
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                history, updated_at, last = self._history(conn, session_id, now)
+                if now - updated_at > self.ttl_seconds:
+                    history = []
+                conn.execute(
+                    "INSERT INTO turns (session_id, turn, user, ai, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (session_id, last + 1, user_message, ai_response, now),
+                )
+                conn.execute(
+                    "DELETE FROM turns WHERE session_id = ? AND turn <= ?",
+                    (session_id, last + 1 - self.max_turns),
+                )
+            history = (history + [{"user": user_message, "ai": ai_response}])[-self.max_turns:]
+            self._remember(session_id, history, now, last + 1)
+
+    def purge_expired(self) -> int:
+        """
+        Delete every session idle for longer than the TTL.
+
+        :return: Number of sessions removed
+        """
+        cutoff = time.time() - self.ttl_seconds
+        with self._db_lock:
+            conn = self._connect()
+            with conn:
+                expired = [row[0] for row in conn.execute(
+                    "SELECT session_id FROM turns GROUP BY session_id HAVING MAX(created_at) < ?", (cutoff,)
+                )]
+                conn.executemany("DELETE FROM turns WHERE session_id = ?", [(sid,) for sid in expired])
+            for sid in expired:
+                self._memory.pop(sid, None)
+        return len(expired)
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,189 @@
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from prompt_builder import count_tokens
+from text_splitter import read_page, split_text
+
+# Target size of a chunk cut from a page's heading/list/table structure, in tokens
+# of the local tokenizer (0: always use the character splitter)
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def render_heading(level: int, text: str) -> str:
+    return f"{'#' * level} {text}"
+
+
+def render_block(block: Dict[str, Any]) -> str:
+    """
+    One crawler block (see content_extraction.extract_blocks) as Markdown-style text.
+    """
+    if block["type"] == "heading":
+        return render_heading(block["level"], block["text"])
+    if block["type"] == "list":
+        return "\n".join(_list_lines(block))
+    if block["type"] == "table":
+        return "\n".join(" | ".join(row) for row in block["rows"])
+    return block["text"]
+
+
+def drop_repeated(blocks: List[Dict[str, Any]], repeated: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Remove non-heading blocks whose fingerprint is in repeated, then headings left without content.
+    """
+    repeated = set(repeated)
+    blocks = [b for b in blocks if b["type"] == "heading" or b.get("fingerprint") not in repeated]
+    kept = []
+    for i, block in enumerate(blocks):
+        if block["type"] == "heading":
+            following = next((b for b in blocks[i + 1:] if b["type"] != "heading" or b["level"] <= block["level"]),
+                             None)
+            if following is None or following["type"] == "heading":
+                continue                                # no content before the next section
+        kept.append(block)
+    return kept
+
+
+def _list_lines(block: Dict[str, Any]) -> List[str]:
+    return [f"{i}. {item}" if block.get("ordered") else f"- {item}" for i, item in enumerate(block["items"], start=1)]
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into pieces of at most max_tokens, at sentence ends where possible, else between words.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    pieces, current = [], []
+    for unit in _SENTENCE_RE.split(text):
+        words = [unit] if count_tokens(unit) <= max_tokens else unit.split(" ")
+        for word in words:
+            if current and count_tokens(" ".join(current + [word])) > max_tokens:
+                pieces.append(" ".join(current))
+                current = []
+            current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _block_pieces(block: Dict[str, Any], max_tokens: int) -> Tuple[List[str], Optional[str]]:
+    """
+    Smallest units a block may be cut into (list items, table rows, sentences).
+
+    :return: Tuple of (pieces, table header row repeated at the top of every chunk or None)
+    """
+    header = None
+    if block["type"] == "list":
+        lines = _list_lines(block)
+    elif block["type"] == "table":
+        lines = [" | ".join(row) for row in block["rows"]]
+        if len(lines) > 1:
+            header, lines = lines[0], lines[1:]
+    else:
+        lines = [block["text"]]
+    budget = max_tokens - (count_tokens(header) if header else 0)
+    return [piece for line in lines for piece in _split_long(line, budget)], header
+
+
+def _common_prefix(paths: List[List[str]]) -> List[str]:
+    prefix = list(paths[0]) if paths else []
+    for path in paths[1:]:
+        n = 0
+        while n < min(len(prefix), len(path)) and prefix[n] == path[n]:
+            n += 1
+        prefix = prefix[:n]
+    return prefix
+
+
+def chunk_blocks(blocks: List[Dict[str, Any]], max_tokens: int = CHUNK_TOKENS) -> List[Tuple[str, List[str]]]:
+    """
+    Chunk a page along its structure. Whole sections are packed together up to
+    max_tokens and a heading starts a new chunk once the current one is half
+    full. A block that does not fit in a chunk of its own is cut between list
+    items, table rows or sentences; each continuation chunk repeats the section
+    heading and, for tables, the header row.
+
+    :param blocks: Blocks saved by the crawler
+    :param max_tokens: Largest chunk, in tokens
+    :return: List of (chunk text, section path), where the section path is the
+             heading trail shared by everything in the chunk
+    """
+    chunks = []
+    parts, paths, tokens = [], [], 0
+    content_end = 0                             # parts[:content_end] end with content; the rest are headings
+    stack = []                                  # open headings: (level, text)
+
+    def flush():
+        # Headings after the last content move on to the next chunk with their section
+        nonlocal parts, paths, tokens, content_end
+        if content_end:
+            chunks.append(("\n\n".join(parts[:content_end]), _common_prefix(paths[:content_end])))
+            parts, paths = parts[content_end:], paths[content_end:]
+            tokens = sum(count_tokens(part) for part in parts)
+            content_end = 0
+
+    def add(text, path, content=True):
+        nonlocal tokens, content_end
+        parts.append(text)
+        paths.append(path)
+        tokens += count_tokens(text)
+        if content:
+            content_end = len(parts)
+
+    for block in blocks:
+        if block["type"] == "heading":
+            while stack and stack[-1][0] >= block["level"]:
+                stack.pop()
+            stack.append((block["level"], block["text"]))
+            if tokens >= max_tokens // 2:
+                flush()
+            add(render_block(block), [text for _, text in stack], content=False)
+            continue
+
+        path = [text for _, text in stack]
+        text = render_block(block)
+        block_tokens = count_tokens(text)
+        if tokens + block_tokens > max_tokens:
+            flush()
+        if tokens + block_tokens <= max_tokens:
+            add(text, path)
+            continue
+
+        pieces, header = _block_pieces(block, max(max_tokens - tokens, max_tokens // 2))
+        lines, line_tokens = ([header], count_tokens(header)) if header else ([], 0)
+        has_piece = False
+        for piece in pieces:
+            piece_tokens = count_tokens(piece)
+            if has_piece and tokens + line_tokens + piece_tokens > max_tokens:
+                add("\n".join(lines), path)
+                flush()
+                if stack:
+                    add(render_heading(*stack[-1]), path, content=False)
+                lines, line_tokens = ([header], count_tokens(header)) if header else ([], 0)
+            lines.append(piece)
+            line_tokens += piece_tokens
+            has_piece = True
+        if has_piece:
+            add("\n".join(lines), path)
+    flush()
+    return chunks
+
+
+def chunk_page_file(file_path: str, chunk_size: int = 500, chunk_overlap: int = 50,
+                    chunk_tokens: int = CHUNK_TOKENS) -> Tuple[str, str, List[str], Optional[List[List[str]]]]:
+    """
+    Read a crawled page JSON and chunk it: along its structure when the crawler
+    saved "blocks" (and chunk_tokens is set), leaving out the blocks it marked as
+    "repeated" across the domain, else with the character splitter.
+
+    :return: Tuple of (document text, source url, chunk strings, section path per chunk or None)
+    """
+    doc_text, page = read_page(file_path)
+    if chunk_tokens and page.get("blocks"):
+        chunks = chunk_blocks(drop_repeated(page["blocks"], page.get("repeated", ())) or page["blocks"],
+                              chunk_tokens)
+        return doc_text, page["source_url"], [text for text, _ in chunks], [path for _, path in chunks]
+    return doc_text, page["source_url"], split_text(page["content"], chunk_size, chunk_overlap), None
@@ -0,0 +1,49 @@
+import re
+import zlib
+import numpy as np
+from typing import Iterable
+
+NUM_PERMUTATIONS = 64
+SHINGLE_SIZE = 5
+# Mersenne-style prime just above 2**32; with a, x < 2**32 the products fit in uint64
+_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(1234)  # fixed seed: signatures are persisted and compared across runs
+_PERM_A = _rng.integers(1, 2**32 - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, 2**32 - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    Stable 32-bit hashes of the word shingles of text (crc32, so they do not
+    depend on PYTHONHASHSEED and can be stored).
+    """
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        grams: Iterable[str] = [" ".join(tokens)] if tokens else []
+    else:
+        grams = (" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1))
+    return np.unique(np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64))
+
+
+def minhash_signature(text: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    """
+    MinHash signature (NUM_PERMUTATIONS uint32 values) of the word shingles of text.
+    """
+    hashes = shingle_hashes(text, size)
+    if not len(hashes):
+        return np.full(NUM_PERMUTATIONS, np.iinfo(np.uint32).max, dtype=np.uint32)
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def estimate_jaccard(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """
+    Estimated Jaccard similarity of the shingle sets behind two MinHash signatures.
+    """
+    return float(np.mean(np.asarray(sig_a) == np.asarray(sig_b)))
@@ -0,0 +1,109 @@
+import json
+from urllib.parse import urlparse
+from typing import Any, Dict, List, Tuple
+
+# Same defaults as langchain's RecursiveCharacterTextSplitter: paragraphs, then
+# lines, then words, then single characters
+DEFAULT_SEPARATORS = ("\n\n", "\n", " ", "")
+
+
+def _split_keeping_separator(text: str, separator: str) -> List[str]:
+    """
+    Split on separator, keeping it at the start of every piece after the first.
+    """
+    if not separator:
+        return list(text)
+    pieces = text.split(separator)
+    splits = [pieces[0]] + [separator + piece for piece in pieces[1:]]
+    return [s for s in splits if s]
+
+
+def _merge_splits(splits: List[str], chunk_size: int, chunk_overlap: int) -> List[str]:
+    """
+    Greedily join splits into chunks of at most chunk_size characters, carrying
+    trailing splits of up to chunk_overlap characters into the next chunk.
+    """
+    docs, total, start = [], 0, 0       # the current chunk is splits[start:i]
+    for i, split in enumerate(splits):
+        length = len(split)
+        if total + length > chunk_size and start < i:
+            doc = "".join(splits[start:i]).strip()
+            if doc:
+                docs.append(doc)
+            while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                total -= len(splits[start])
+                start += 1
+        total += length
+    doc = "".join(splits[start:]).strip()
+    if doc:
+        docs.append(doc)
+    return docs
+
+
+def split_text(text: str, chunk_size: int = 500, chunk_overlap: int = 50,
+               separators: Tuple[str, ...] = DEFAULT_SEPARATORS) -> List[str]:
+    """
+    Recursive character splitter producing the same chunks as
+    RecursiveCharacterTextSplitter(chunk_size, chunk_overlap, length_function=len)
+    with its default (keep-separator) settings, without importing langchain.
+
+    :param text: Text to split
+    :param chunk_size: Maximum chunk length in characters
+    :param chunk_overlap: Characters of trailing context repeated at the start of the next chunk
+    :param separators: Separators to try, coarsest first; "" splits into characters
+    :return: List of chunk strings
+    """
+    separator, finer = separators[-1], ()
+    for i, candidate in enumerate(separators):
+        if candidate == "":
+            separator = candidate
+            break
+        if candidate in text:
+            separator, finer = candidate, separators[i + 1:]
+            break
+
+    chunks, good = [], []
+    for split in _split_keeping_separator(text, separator):
+        if len(split) < chunk_size:
+            good.append(split)
+            continue
+        if good:
+            chunks.extend(_merge_splits(good, chunk_size, chunk_overlap))
+            good = []
+        if finer:
+            chunks.extend(split_text(split, chunk_size, chunk_overlap, finer))
+        else:
+            chunks.append(split)
+    if good:
+        chunks.extend(_merge_splits(good, chunk_size, chunk_overlap))
+    return chunks
+
+
+def sanitize_filename(url):
+    """
+    Create a safe filename from the URL.
+    """
+    parsed_url = urlparse(url)
+    filename = parsed_url.netloc + parsed_url.path  # Use domain and path for filename
+    filename = filename.replace('/', '_').replace(':', '_').replace('?', '_').replace('&', '_')  # Sanitize
+    if filename.endswith('_'):
+        filename = filename[:-1]
+    return filename
+
+
+def read_page(file_path: str) -> Tuple[str, Dict[str, Any]]:
+    """
+    Read a crawled page JSON. Runs in chunking worker processes (via
+    structured_chunking.chunk_page_file), so this module only imports the standard library.
+
+    :return: Tuple of (document text sent for contextualization, parsed page)
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        doc_text = f.read()
+    page = json.loads(doc_text)
+    if "blocks" in page:
+        # The structure repeats the content; keep it out of the document sent for contextualization
+        doc_text = json.dumps({"source_url": page["source_url"], "content": page["content"]},
+                              ensure_ascii=False, indent=4)
+    return doc_text, page
+
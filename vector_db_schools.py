@@ -1,18 +1,154 @@
 import os
+import asyncio
 import pickle
 import json
+import hashlib
+import threading
+from urllib.parse import urlparse
 import numpy as np
 import voyageai
 import anthropic
 from typing import List, Dict, Any
 from tqdm import tqdm
+import index_store
+from embedding_cache import EmbeddingCache
+from bm25 import BM25Index
+from ann import IVFIndex
+from query_cache import QueryEmbeddingCache
+from metrics import span
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# Storage dtypes for the embedding matrix. float16 halves memory, int8 quarters
+# it (rows are L2-normalized, so components fit in [-1, 1] and scale by 127).
+EMBEDDING_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+INT8_SCALE = 127.0
+# Rows converted to float32 at a time when scoring a float16/int8 matrix
+SCORE_BLOCK_ROWS = 8192
+# Reciprocal-rank fusion constant (rank contributions are 1 / (RRF_K + rank))
+RRF_K = 60
+QUERY_MODEL = "voyage-3-large"
+# Below this many rows an exact scan is as fast as ANN, so no IVF index is built
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "20000"))
+# Inverted lists probed per query: the ANN recall/latency knob
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+# Metadata fields the index is partitioned on; search filters may use any of them
+PARTITION_FIELDS = ("school", "domain", "section")
+# Lock-free compaction attempts in save_db before compacting under the lock
+COMPACT_ATTEMPTS = 3
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """
+    Return a contiguous float32 copy of vectors with every row scaled to unit length.
+    """
+    matrix = np.ascontiguousarray(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores along the last axis, best first.
+    Uses argpartition so only the k winners are sorted.
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        part = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_id(source_url: str, chunk_number, text: str) -> str:
+    """
+    Stable chunk identifier: source page, chunk number and a hash of the chunk text.
+    """
+    return f"{source_url}#{chunk_number}:{content_hash(text)}"
+
+
+def chunk_source_urls(meta: Dict[str, Any]) -> List[str]:
+    """
+    Pages a row stands for: its own page, then the pages of near-duplicates collapsed into it at ingestion.
+    """
+    return meta.get("source_urls") or [meta["source_url"]]
+
+
+def lexical_text(meta: Dict[str, Any]) -> str:
+    """
+    Text indexed by BM25 for a row: the chunk plus its generated context and section headings.
+    """
+    text = f"{meta['content']}\n{meta.get('context', '')}"
+    if meta.get("section_path"):
+        text += "\n" + " ".join(meta["section_path"])
+    return text
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], rrf_k: int = RRF_K) -> Dict[int, float]:
+    """
+    Fuse ranked row lists into one score per row: sum of 1 / (rrf_k + rank).
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (rrf_k + rank)
+    return fused
+
+
+def chunk_to_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Index metadata for a chunk record written by preprocess.py.
+    """
+    chunk_number = chunk.get("Chunk Number")
+    parsed = urlparse(chunk['source_url'])
+    path_parts = [p for p in parsed.path.split("/") if p]
+    meta = {
+        'content': chunk['chunk_text'],
+        'context': chunk['context'],
+        'source_url': chunk['source_url'],
+        'chunk_number': chunk_number,
+        'chunk_id': chunk_id(chunk['source_url'], chunk_number, chunk['chunk_text']),
+        # School folder under website_content/, set by preprocess when loading chunk files
+        'school': chunk.get('school'),
+        'domain': parsed.netloc,
+        'section': path_parts[0] if path_parts else "",
+    }
+    if chunk.get('section_path'):
+        # Heading trail within the page, from structure-aware chunking
+        meta['section_path'] = chunk['section_path']
+    return meta
+
+
+def build_partitions(metadata) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Group row numbers by each PARTITION_FIELDS value.
+    """
+    groups = {field: {} for field in PARTITION_FIELDS}
+    for row, meta in enumerate(metadata):
+        for field in PARTITION_FIELDS:
+            value = meta.get(field)
+            if value is not None:
+                groups[field].setdefault(value, []).append(row)
+    return {
+        field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+        for field, values in groups.items()
+    }
+
 
 class VectorDB:
-    def __init__(self, name: str, voyage_api_key = None, anthropic_api_key=None):
+    def __init__(self, name: str, voyage_api_key = None, anthropic_api_key=None, voyage_client=None, dtype: str = "float32",
+                 embedding_cache: EmbeddingCache = None, ann_nprobe: int = ANN_NPROBE, async_voyage_client=None,
+                 query_cache: QueryEmbeddingCache = None):
 
         if voyage_api_key is None:
             api_key = os.getenv("VOYAGE_API_KEY")
@@ -20,133 +156,771 @@ class VectorDB:
             anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
         
         self.anthropic_client = anthropic.Anthropic(api_key=anthropic_api_key)
-        self.client = voyageai.Client(api_key=voyage_api_key)
+        # Reuse a caller-provided client so reloads don't open a new connection pool
+        self.client = voyage_client or voyageai.Client(api_key=voyage_api_key)
+        self._voyage_api_key = voyage_api_key
+        self._async_client = async_voyage_client
         self.name = name
-        self.embeddings = []
+        # Chunk embeddings are looked up here before anything is sent to voyage
+        self.embedding_cache = embedding_cache if embedding_cache is not None else EmbeddingCache()
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype {dtype!r}; expected one of {sorted(EMBEDDING_DTYPES)}")
+        self.dtype = dtype
+        # Preallocated row buffer; self.embeddings is a view of its first _size rows
+        self._matrix = np.empty((0, 0), dtype=EMBEDDING_DTYPES[dtype])
+        self._size = 0
         self.metadata = []
-        self.query_cache = {}
+        # Rows tombstoned by delete/replace; excluded from search until compact() drops them
+        self._deleted = set()
+        self._lock = threading.RLock()
+        self._version = 0
+        self._row_by_id = self._row_by_slot = self._row_by_legacy = None
+        # Lexical index over content + context, aligned with embedding rows; rebuilt lazily
+        self.bm25 = None
+        # IVF index over the first ann.num_rows rows (None: exact search)
+        self.ann = None
+        self.ann_nprobe = ann_nprobe
+        # field -> value -> row ids; rebuilt lazily after in-memory updates
+        self.partitions = None
+        # Bounded, normalized query -> embedding cache shared by all workers
+        self.query_cache = query_cache if query_cache is not None else QueryEmbeddingCache()
         # self.db_path = f"./data/{name}/vector_db.pkl"
-        self.db_path = f"./data/{name}/schools_db.pkl"
+        # Legacy single-pickle index, converted to the directory format on first load
+        self.legacy_db_path = f"./data/{name}/schools_db.pkl"
+        self.db_path = f"./data/{name}/index"
+        self.index_header = {}
+        # Name of the on-disk generation last loaded or saved
+        self.index_generation = None
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """
+        The stored (normalized, possibly quantized) embedding rows as a contiguous view.
+        """
+        return self._matrix[: self._size]
+
+    @embeddings.setter
+    def embeddings(self, vectors):
+        self._deleted = set()
+        self.ann = None
+        self._size = 0
+        self._matrix = np.empty((0, 0), dtype=EMBEDDING_DTYPES[self.dtype])
+        if vectors is not None and len(vectors):
+            self._append_embeddings(vectors)
+
+    def _append_embeddings(self, vectors):
+        """
+        Normalize and append embedding rows, growing the preallocated buffer geometrically.
+        """
+        rows = normalize_rows(vectors)
+        needed = self._size + len(rows)
+        if self._matrix.shape[1] not in (0, rows.shape[1]):
+            raise ValueError(f"Embedding dimension mismatch: {rows.shape[1]} != {self._matrix.shape[1]}")
+        if needed > self._matrix.shape[0]:
+            capacity = max(needed, 2 * self._matrix.shape[0], 1024)
+            grown = np.empty((capacity, rows.shape[1]), dtype=self._matrix.dtype)
+            if self._size:
+                grown[: self._size] = self._matrix[: self._size]
+            self._matrix = grown
+        if self.dtype == "int8":
+            rows = np.clip(np.rint(rows * INT8_SCALE), -127, 127)
+        self._matrix[self._size : needed] = rows
+        self._size = needed
+
+    def _score(self, queries: np.ndarray, matrix: np.ndarray = None) -> np.ndarray:
+        """
+        Cosine similarities of every stored row against each query row (one GEMM).
+
+        :param queries: (m, d) float32 matrix of normalized query embeddings
+        :param matrix: Embedding rows to score (defaults to self.embeddings)
+        :return: (m, n) similarity matrix
+        """
+        matrix = self.embeddings if matrix is None else matrix
+        if self.dtype == "float32":
+            return queries @ matrix.T
+        # Up-convert in blocks so float16/int8 storage never materializes a full float32 copy
+        scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+            block = matrix[start : start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start : start + len(block)] = queries @ block.T
+        if self.dtype == "int8":
+            scores /= INT8_SCALE
+        return scores
+
+    @property
+    def index_marker_path(self) -> str:
+        """
+        File whose mtime changes every time a new index generation is saved.
+        """
+        return index_store.current_marker(self.db_path)
+
+    def _ensure_index(self):
+        """
+        Convert the legacy pickle into the directory format if that is all we have.
+        """
+        if not index_store.index_exists(self.db_path) and os.path.exists(self.legacy_db_path):
+            print(f"Converting legacy vector database {self.legacy_db_path} to {self.db_path}")
+            index_store.convert_pickle(self.legacy_db_path, self.db_path, self.dtype)
 
     def load_vector_db(self):
-        if os.path.exists(self.db_path):
+        try:
+            self._ensure_index()
+        except Exception as e:
+            print(f"Error converting legacy vector database: {e}")
+            return False
+        if index_store.index_exists(self.db_path):
             try:
-                with open(self.db_path, 'rb') as f:
-                    data = pickle.load(f)
-                    self.embeddings = data.get('embeddings', [])
-                    self.metadata = data.get('metadata', [])
-                    
-                    # Ensure query_cache is a dictionary
-                    self.query_cache = data.get('query_cache', {})
-                    if not isinstance(self.query_cache, dict):
-                        self.query_cache = {}
-                
+                with span("index_load"):
+                    self.load_db()
                 return True
             except Exception as e:
                 print(f"Error loading vector database: {e}")
-                # Fallback to empty cache if loading fails
-                self.query_cache = {}
                 return False
         else:
-            print(f"Vector database file not found at {self.db_path}")
-            self.query_cache = {}  # Ensure it's a dictionary
+            print(f"Vector database not found at {self.db_path}")
             return False
 
     def load_data(self, dataset: List[Dict[str, Any]]):
-        if self.embeddings and self.metadata:
-            print("Vector database is already loaded. Skipping data loading.")
-            return
-        if os.path.exists(self.db_path):
+        """
+        Bring the index in line with dataset: load what is on disk, embed only
+        new or changed chunks and drop chunks that are no longer present.
+        """
+        self._ensure_index()
+        if not len(self.embeddings) and index_store.index_exists(self.db_path):
             print("Loading vector database from disk.")
             self.load_db()
-            return
 
-        texts_to_embed = []
-        metadata = []
-        total_chunks = len(dataset) # sum(len(doc['chunks']) for doc in dataset)
-        print(f"Total chunks to process: {total_chunks}")
-        with tqdm(total=total_chunks, desc="Processing chunks") as pbar:
-            # for doc in dataset:
-                for chunk in dataset: #doc['chunks']
-                    texts_to_embed.append(chunk['chunk_text'])
-                    metadata.append({
-                        'content': chunk['chunk_text'],
-                        'context': chunk['context'],
-                        'source_url': chunk['source_url'],
-                    })
-                pbar.update(1)
-
-        self._embed_and_store(texts_to_embed, metadata)
-        self.save_db()
-        
-        print(f"Vector database loaded and saved. Total chunks processed: {len(texts_to_embed)}")
+        print(f"Total chunks to process: {len(dataset)}")
+        stats = self.sync_chunks(dataset)
+        print(f"Index sync: {stats}")
+        if stats["added"] or stats["updated"] or stats["deleted"] or not index_store.index_exists(self.db_path):
+            self.save_db()
+            print(f"Vector database saved. Total chunks: {self.live_count}")
+        else:
+            print("Vector database is up to date.")
 
-    def _embed_and_store(self, texts: List[str], data: List[Dict[str, Any]]):
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, sending only distinct texts missing from the embedding cache to voyage.
+        """
         batch_size = 128
-        with tqdm(total=len(texts), desc="Embedding chunks") as pbar:
-            result = []
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i : i + batch_size]
-                batch_result = self.client.embed(batch, model="voyage-3-large").embeddings
-                result.extend(batch_result)
+        model = "voyage-3-large"
+        vectors = self.embedding_cache.get_many(model, texts)
+        # Repeated boilerplate within this run is embedded once
+        missing = [t for t in dict.fromkeys(texts) if t not in vectors]
+        print(f"Embedding cache: {len(texts) - len(missing)} of {len(texts)} chunks cached, {len(missing)} to embed")
+        with tqdm(total=len(missing), desc="Embedding chunks") as pbar:
+            for i in range(0, len(missing), batch_size):
+                batch = missing[i : i + batch_size]
+                batch_result = self.client.embed(batch, model=model).embeddings
+                self.embedding_cache.put_many(model, batch, batch_result)
+                vectors.update(zip(batch, batch_result))
                 pbar.update(len(batch))
-        
-        self.embeddings = result
-        self.metadata = data
+        return [vectors[t] for t in texts]
 
-    def search(self, query: str, k: int = 10) -> List[Dict[str, Any]]:
-        if query in self.query_cache:
-            query_embedding = self.query_cache[query]
-        else:
-            query_embedding = self.client.embed([query], model="voyage-3-large").embeddings[0]
-            self.query_cache[query] = query_embedding
+    def _embed_and_store(self, texts: List[str], data: List[Dict[str, Any]]):
+        with self._lock:
+            self.embeddings = None
+            if texts:
+                self._append_embeddings(self._embed_texts(texts))
+            self.metadata = data
+            self._mutated()
+
+    # --- incremental updates -------------------------------------------------
+
+    @property
+    def live_count(self) -> int:
+        return self._size - len(self._deleted)
+
+    def live_metadata(self, schools=None) -> List[Dict[str, Any]]:
+        """
+        Metadata of the rows that are not tombstoned.
+
+        :param schools: Only rows of these schools (default: all)
+        """
+        schools = set(schools) if schools is not None else None
+        with self._lock:
+            return [meta for row, meta in enumerate(self.metadata)
+                    if row not in self._deleted and (schools is None or meta.get("school") in schools)]
+
+    def _mutated(self, keep_row_index: bool = False):
+        self._version += 1
+        self.bm25 = None
+        self.partitions = None
+        if not keep_row_index:
+            self._row_by_id = None
+            self._row_by_slot = None
+            self._row_by_legacy = None
+
+    def _writable_metadata(self) -> List[Dict[str, Any]]:
+        # Lazily-read metadata from a mapped index is read-only; materialize it for edits
+        if not isinstance(self.metadata, list):
+            self.metadata = list(self.metadata)
+        return self.metadata
+
+    def _build_row_index(self):
+        """
+        Map chunk IDs, (source_url, chunk number) slots and legacy content keys to live rows.
+        """
+        if self._row_by_id is not None:
+            return
+        self._row_by_id, self._row_by_slot, self._row_by_legacy = {}, {}, {}
+        for row, meta in enumerate(self.metadata):
+            if row in self._deleted:
+                continue
+            if meta.get("chunk_id"):
+                self._row_by_id[meta["chunk_id"]] = row
+                self._row_by_slot[(meta["source_url"], meta.get("chunk_number"))] = row
+            else:
+                # Rows written before chunk IDs existed are matched by content instead
+                self._row_by_legacy[(meta["source_url"], content_hash(meta["content"]))] = row
+
+    def upsert_chunks(self, chunks: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Add new chunks, replace changed ones and refresh context of unchanged ones.
+        Only chunks whose text is not already indexed are sent for embedding.
+
+        :param chunks: Chunk records as written by preprocess ("Chunk Number", "chunk_text", ...)
+        :return: Counts of added, updated (metadata only) and replaced rows
+        """
+        with self._lock:
+            self._build_row_index()
+            to_embed, replaced = [], []
+            stats = {"added": 0, "updated": 0, "replaced": 0, "unchanged": 0}
+            for chunk in chunks:
+                meta = chunk_to_metadata(chunk)
+                row = self._row_by_id.get(meta["chunk_id"])
+                if row is None:
+                    row = self._row_by_legacy.pop((meta["source_url"], content_hash(meta["content"])), None)
+                if row is not None:
+                    # source_urls belongs to set_duplicate_sources, not to the chunk record
+                    stored = {k: v for k, v in self.metadata[row].items() if k != "source_urls"}
+                    if stored != meta:
+                        self._writable_metadata()[row] = meta
+                        self._row_by_id[meta["chunk_id"]] = row
+                        self._row_by_slot[(meta["source_url"], meta["chunk_number"])] = row
+                        stats["updated"] += 1
+                    else:
+                        stats["unchanged"] += 1
+                    continue
+                old_row = self._row_by_slot.get((meta["source_url"], meta["chunk_number"]))
+                if old_row is not None:
+                    replaced.append(old_row)
+                to_embed.append(meta)
+            version = self._version
+
+        vectors = self._embed_texts([meta["content"] for meta in to_embed]) if to_embed else []
+
+        with self._lock:
+            if self._version != version:
+                raise RuntimeError("Index changed during upsert; retry the update.")
+            first_row = self._size
+            if to_embed:
+                self._writable_metadata().extend(to_embed)
+                self._append_embeddings(vectors)
+            self._deleted.update(replaced)
+            stats["added"] = len(to_embed) - len(replaced)
+            stats["replaced"] = len(replaced)
+            if to_embed or replaced or stats["updated"]:
+                # Keep the row index current instead of rebuilding it, so streaming
+                # many small batches in stays linear in the index size
+                for row in replaced:
+                    self._row_by_id.pop(self.metadata[row].get("chunk_id"), None)
+                for row, meta in enumerate(to_embed, start=first_row):
+                    self._row_by_id[meta["chunk_id"]] = row
+                    self._row_by_slot[(meta["source_url"], meta["chunk_number"])] = row
+                self._mutated(keep_row_index=True)
+        return stats
+
+    def delete_chunks(self, chunk_ids) -> int:
+        """
+        Tombstone rows by chunk ID. Space is reclaimed by compact().
+
+        :return: Number of rows deleted
+        """
+        with self._lock:
+            self._build_row_index()
+            rows = {self._row_by_id[cid] for cid in chunk_ids if cid in self._row_by_id}
+            self._deleted.update(rows)
+            if rows:
+                self._mutated()
+            return len(rows)
 
-        if not self.embeddings:
+    def delete_sources(self, source_urls) -> int:
+        """
+        Tombstone every row that came from one of source_urls.
+
+        :return: Number of rows deleted
+        """
+        source_urls = set(source_urls)
+        with self._lock:
+            rows = {
+                row for row, meta in enumerate(self.metadata)
+                if row not in self._deleted and meta["source_url"] in source_urls
+            }
+            self._deleted.update(rows)
+            if rows:
+                self._mutated()
+            return len(rows)
+
+    def sync_chunks(self, chunks: List[Dict[str, Any]], sources=None) -> Dict[str, int]:
+        """
+        Make the index match chunks: upsert them and delete indexed rows that are
+        no longer in the set (including every chunk of a page that disappeared).
+
+        :param chunks: The complete set of chunks for the sources being synced
+        :param sources: Restrict deletions to these source URLs (default: all indexed sources)
+        :return: Upsert counts plus the number of deleted rows
+        """
+        stats = self.upsert_chunks(chunks)
+        keep = {chunk_to_metadata(chunk)["chunk_id"] for chunk in chunks}
+        stats["deleted"] = self.prune_chunks(keep, sources=sources)
+        return stats
+
+    def prune_chunks(self, keep, sources=None, schools=None) -> int:
+        """
+        Tombstone indexed rows whose chunk ID is not in keep.
+
+        :param keep: Chunk IDs that are still current
+        :param sources: Only consider rows from these source URLs (default: all)
+        :param schools: Only consider rows of these schools (default: all)
+        :return: Number of rows deleted
+        """
+        sources = set(sources) if sources is not None else None
+        schools = set(schools) if schools is not None else None
+        with self._lock:
+            stale = {
+                row for row, meta in enumerate(self.metadata)
+                if row not in self._deleted
+                and (sources is None or meta["source_url"] in sources)
+                and (schools is None or meta.get("school") in schools)
+                and meta.get("chunk_id") not in keep
+            }
+            self._deleted.update(stale)
+            if stale:
+                self._mutated()
+        return len(stale)
+
+    def set_duplicate_sources(self, chunk_ids, duplicates: Dict[str, List[str]], sources=None) -> int:
+        """
+        Record the pages whose near-duplicate chunks were collapsed into each row as
+        meta["source_urls"] (the row's own page first, then the others sorted); rows
+        without duplicates lose the field.
+
+        :param chunk_ids: Chunk IDs of the rows to update (None: every live row)
+        :param duplicates: Canonical chunk ID -> source URLs of its duplicates
+        :param sources: Only these pages were re-ingested (partial run): URLs of other
+                        pages already recorded on a row are kept (default: replace all)
+        :return: Number of rows changed
+        """
+        sources = set(sources) if sources is not None else None
+        with self._lock:
+            self._build_row_index()
+            changed = 0
+            for cid in list(self._row_by_id) if chunk_ids is None else chunk_ids:
+                row = self._row_by_id.get(cid)
+                if row is None:
+                    continue
+                meta = self.metadata[row]
+                others = set() if sources is None else {url for url in meta.get("source_urls", [])[1:]
+                                                        if url not in sources}
+                others.update(duplicates.get(cid, ()))
+                others.discard(meta["source_url"])
+                # Sorted, so a run that finds the same duplicates (full or partial) changes nothing
+                wanted = [meta["source_url"]] + sorted(others) if others else None
+                if meta.get("source_urls") == wanted:
+                    continue
+                meta = {k: v for k, v in meta.items() if k != "source_urls"}
+                if wanted:
+                    meta["source_urls"] = wanted
+                self._writable_metadata()[row] = meta
+                changed += 1
+            if changed:
+                self._mutated(keep_row_index=True)
+            return changed
+
+    def compact(self) -> int:
+        """
+        Drop tombstoned rows from the embedding matrix and metadata. The copy is made
+        without holding the lock, so searches keep running against the old arrays.
+
+        :return: Number of rows reclaimed (0 if the index changed meanwhile)
+        """
+        with self._lock:
+            if not self._deleted:
+                return 0
+            version = self._version
+            matrix, metadata, deleted = self.embeddings, self.metadata, set(self._deleted)
+
+        keep = np.array([row for row in range(len(matrix)) if row not in deleted], dtype=np.intp)
+        new_matrix = np.ascontiguousarray(matrix[keep])
+        new_metadata = [metadata[row] for row in keep]
+
+        with self._lock:
+            if self._version != version:
+                return 0
+            self._matrix = new_matrix
+            self._size = len(new_matrix)
+            self.metadata = new_metadata
+            self._deleted = set()
+            # Row numbers changed; the IVF lists are rebuilt on the next save
+            self.ann = None
+            self._mutated()
+        return len(deleted)
+
+    # --- search ----------------------------------------------------------------
+
+    def _snapshot(self):
+        with self._lock:
+            return self.embeddings, self.metadata, frozenset(self._deleted), self.ann
+
+    def _partitions_for(self, metadata) -> Dict[str, Dict[str, np.ndarray]]:
+        with self._lock:
+            if self.partitions is None:
+                self.partitions = build_partitions(metadata)
+            return self.partitions
+
+    def _filter_rows(self, filter: Dict[str, Any], metadata) -> np.ndarray:
+        """
+        Sorted row ids matching filter, e.g. {"school": "TAMU"} or
+        {"school": ["TAMU", "ERAU"], "section": "admissions"}. Values within a
+        field are OR-ed, fields are AND-ed.
+        """
+        partitions = self._partitions_for(metadata)
+        rows = None
+        for field, values in filter.items():
+            if field not in partitions:
+                raise ValueError(f"Cannot filter on {field!r}; partitioned fields are {PARTITION_FIELDS}")
+            values = [values] if isinstance(values, str) else list(values)
+            matched = [partitions[field][v] for v in values if v in partitions[field]]
+            field_rows = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+            rows = field_rows if rows is None else np.intersect1d(rows, field_rows)
+        return rows
+
+    def filter_values(self, field: str = "school") -> List[str]:
+        """
+        Distinct values of a partitioned field (e.g. every indexed school).
+        """
+        matrix, metadata, deleted, ann = self._snapshot()
+        return sorted(self._partitions_for(metadata).get(field, {}))
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Embed queries (one voyage call for all cache misses) and return normalized rows.
+        """
+        with span("query_embed"):
+            cached = self.query_cache.get_many(QUERY_MODEL, queries)
+            missing = [q for q in dict.fromkeys(queries) if q not in cached]
+            if missing:
+                result = self.client.embed(missing, model=QUERY_MODEL).embeddings
+                self.query_cache.put_many(QUERY_MODEL, missing, result)
+                cached.update(zip(missing, result))
+            return normalize_rows([cached[q] for q in queries])
+
+    @property
+    def async_client(self):
+        """
+        voyageai.AsyncClient used by the async search path (created on first use).
+        """
+        if self._async_client is None:
+            self._async_client = voyageai.AsyncClient(api_key=self._voyage_api_key)
+        return self._async_client
+
+    @property
+    def index_version(self) -> str:
+        """
+        Changes whenever the searchable contents change (new generation or in-memory update).
+        """
+        return f"{self.index_generation}:{self._version}"
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Normalized query embedding, served from the query cache when possible.
+        """
+        return self._embed_queries([query])[0]
+
+    async def aembed_query(self, query: str) -> np.ndarray:
+        return (await self._aembed_queries([query]))[0]
+
+    async def _aembed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Async counterpart of _embed_queries; does not block the event loop on voyage or the query cache.
+        """
+        with span("query_embed"):
+            # The query cache is backed by SQLite; keep its I/O off the event loop
+            cached = await asyncio.to_thread(self.query_cache.get_many, QUERY_MODEL, queries)
+            missing = [q for q in dict.fromkeys(queries) if q not in cached]
+            if missing:
+                result = (await self.async_client.embed(missing, model=QUERY_MODEL)).embeddings
+                await asyncio.to_thread(self.query_cache.put_many, QUERY_MODEL, missing, result)
+                cached.update(zip(missing, result))
+            return normalize_rows([cached[q] for q in queries])
+
+    def _dense_top_k(self, queries: np.ndarray, matrix, deleted, ann, k: int, nprobe: int = None,
+                     rows: np.ndarray = None):
+        """
+        Top-k rows per query, via the IVF index for large corpora or an exact scan otherwise.
+        When rows is given (a filter's partition), only those rows are scored.
+
+        :return: One (rows, similarities) pair of arrays per query, best first
+        """
+        if rows is not None:
+            if deleted:
+                rows = rows[~np.isin(rows, list(deleted))]
+            similarities = self._score(queries, matrix[rows])
+            results = []
+            for row in similarities:
+                top = top_k_indices(row, k)
+                results.append((rows[top], row[top]))
+            return results
+
+        if ann is not None and len(matrix) >= ANN_MIN_ROWS:
+            nprobe = nprobe or self.ann_nprobe
+            # Rows appended since the IVF build are not in any list; always scan them
+            tail = np.arange(ann.num_rows, len(matrix))
+            results = []
+            for query in queries:
+                rows = np.concatenate([ann.candidates(query, nprobe), tail])
+                if deleted:
+                    rows = rows[~np.isin(rows, list(deleted))]
+                rows.sort()  # sequential access into the (possibly memory-mapped) matrix
+                scores = self._score(query[None, :], matrix[rows])[0]
+                top = top_k_indices(scores, k)
+                results.append((rows[top], scores[top]))
+            return results
+
+        similarities = self._score(queries, matrix)
+        if deleted:
+            similarities[:, list(deleted)] = -np.inf
+        results = []
+        for row in similarities:
+            top = top_k_indices(row, k)
+            top = top[np.isfinite(row[top])]
+            results.append((top, row[top]))
+        return results
+
+    def search(self, query: str, k: int = 10, nprobe: int = None, filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        return self.search_many([query], k, nprobe, filter)[0]
+
+    def search_many(self, queries: List[str], k: int = 10, nprobe: int = None,
+                    filter: Dict[str, Any] = None, query_vectors: np.ndarray = None) -> List[List[Dict[str, Any]]]:
+        """
+        Score a batch of queries against the corpus. Small corpora are scanned
+        exactly in a single matrix product; corpora of ANN_MIN_ROWS or more rows
+        with an IVF index only score the rows in the nprobe closest lists.
+
+        :param queries: Query strings
+        :param k: Number of results per query
+        :param nprobe: Override the IVF lists probed per query (higher = better recall)
+        :param filter: Restrict scoring to matching partitions, e.g. {"school": "TAMU"}
+        :param query_vectors: Already-embedded, normalized queries (skips the voyage call)
+        :return: One ranked result list per query, in input order
+        """
+        matrix, metadata, deleted, ann = self._snapshot()
+        if not len(matrix):
             raise ValueError("No data loaded in the vector database.")
+        if not queries:
+            return []
 
-        similarities = np.dot(self.embeddings, query_embedding)
-        top_indices = np.argsort(similarities)[::-1][:k]
-        
-        top_results = []
-        for idx in top_indices:
-            result = {
-                "metadata": self.metadata[idx],
-                "similarity": float(similarities[idx]),
+        rows = self._filter_rows(filter, metadata) if filter else None
+        if query_vectors is None:
+            query_vectors = self._embed_queries(queries)
+        with span("vector_search"):
+            hits = self._dense_top_k(query_vectors, matrix, deleted, ann, k, nprobe, rows)
+        return [
+            [
+                {
+                    "metadata": metadata[idx],
+                    "similarity": float(score),
+                }
+                for idx, score in zip(rows, scores)
+            ]
+            for rows, scores in hits
+        ]
+
+    def _lexical_index(self, metadata) -> BM25Index:
+        with self._lock:
+            if self.bm25 is None or self.bm25.num_docs != len(metadata):
+                self.bm25 = BM25Index.build(lexical_text(meta) for meta in metadata)
+            return self.bm25
+
+    def _lexical_scores(self, query: str, metadata, deleted, rows: np.ndarray = None) -> np.ndarray:
+        scores = self._lexical_index(metadata).score(query)
+        if deleted:
+            scores[list(deleted)] = 0.0
+        if rows is not None:
+            masked = np.zeros_like(scores)
+            masked[rows] = scores[rows]
+            scores = masked
+        return scores
+
+    def lexical_search(self, query: str, k: int = 10, filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        BM25 search over chunk content and context. No embedding call is made.
+        """
+        matrix, metadata, deleted, ann = self._snapshot()
+        rows = self._filter_rows(filter, metadata) if filter else None
+        scores = self._lexical_scores(query, metadata, deleted, rows)
+        return [
+            {"metadata": metadata[idx], "bm25": float(scores[idx])}
+            for idx in top_k_indices(scores, k)
+            if scores[idx] > 0
+        ]
+
+    def hybrid_search(self, query: str, k: int = 10, dense_k: int = None, lexical_k: int = None,
+                      rrf_k: int = RRF_K, filter: Dict[str, Any] = None,
+                      query_vector: np.ndarray = None) -> List[Dict[str, Any]]:
+        """
+        Dense and BM25 retrieval fused with reciprocal-rank fusion.
+
+        :param query: Query string
+        :param k: Number of fused results to return
+        :param dense_k: Dense candidates to fuse (default 2 * k)
+        :param lexical_k: BM25 candidates to fuse (default 2 * k)
+        :param rrf_k: RRF rank offset
+        :param filter: Restrict both retrievers to matching partitions, e.g. {"school": "TAMU"}
+        :param query_vector: Already-embedded, normalized query (skips the voyage call)
+        :return: Results with metadata, dense similarity (None if lexical-only) and rrf_score
+        """
+        matrix, metadata, deleted, ann = self._snapshot()
+        if not len(matrix):
+            raise ValueError("No data loaded in the vector database.")
+        dense_k = dense_k or 2 * k
+        lexical_k = lexical_k or 2 * k
+
+        filter_rows = self._filter_rows(filter, metadata) if filter else None
+        if query_vector is None:
+            query_vector = self._embed_queries([query])
+        with span("vector_search"):
+            rows, scores = self._dense_top_k(np.atleast_2d(query_vector), matrix, deleted, ann, dense_k,
+                                             rows=filter_rows)[0]
+            similarities = dict(zip(rows.tolist(), scores.tolist()))
+            dense_rows = list(similarities)
+        with span("lexical_search"):
+            lexical_scores = self._lexical_scores(query, metadata, deleted, filter_rows)
+            lexical_rows = [int(idx) for idx in top_k_indices(lexical_scores, lexical_k) if lexical_scores[idx] > 0]
+
+        fused = reciprocal_rank_fusion([dense_rows, lexical_rows], rrf_k)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [
+            {
+                "metadata": metadata[row],
+                "similarity": similarities.get(row),
+                "rrf_score": fused[row],
             }
-            top_results.append(result)
-        
-        return top_results
+            for row in ranked
+        ]
+
+    async def asearch(self, query: str, k: int = 10, nprobe: int = None,
+                      filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        search() for async callers: the voyage call is awaited and the
+        NumPy scoring runs in a worker thread.
+        """
+        query_vectors = await self._aembed_queries([query])
+        results = await asyncio.to_thread(self.search_many, [query], k, nprobe, filter, query_vectors)
+        return results[0]
+
+    async def ahybrid_search(self, query: str, k: int = 10, dense_k: int = None, lexical_k: int = None,
+                             rrf_k: int = RRF_K, filter: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """
+        hybrid_search() for async callers.
+        """
+        query_vector = await self._aembed_queries([query])
+        return await asyncio.to_thread(self.hybrid_search, query, k, dense_k, lexical_k, rrf_k, filter, query_vector)
 
     def save_db(self):
-        data = {
-            "embeddings": self.embeddings,
-            "metadata": self.metadata,
-            "query_cache": json.dumps(self.query_cache),
-        }
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        with open(self.db_path, "wb") as file:
-            pickle.dump(data, file)
+        # Tombstoned rows are never written; compact first so the saved rows line up.
+        # The lock-free copy fails if a writer gets in first; after COMPACT_ATTEMPTS
+        # it is made under the (re-entrant) lock, where no writer can interleave
+        for _ in range(COMPACT_ATTEMPTS):
+            if not self._deleted or self.compact():
+                break
+        with self._lock:
+            if self._deleted:
+                self.compact()
+            matrix, metadata, version = self.embeddings, self.metadata, self._version
+        bm25 = BM25Index.build(lexical_text(meta) for meta in metadata)
+        ann = IVFIndex.build(matrix) if len(matrix) >= ANN_MIN_ROWS else None
+
+        partitions = build_partitions(metadata)
+
+        def write_side_indexes(gen_dir):
+            bm25.save(gen_dir)
+            index_store.save_partitions(gen_dir, partitions)
+            if ann is not None:
+                ann.save(gen_dir)
+
+        gen_dir = index_store.write_index(
+            self.db_path,
+            matrix,
+            metadata,
+            self.dtype,
+            {"embedding_model": "voyage-3-large", "name": self.name,
+             "ann": f"ivf{ann.nlist}" if ann is not None else None},
+            extra_writer=write_side_indexes,
+        )
+        with self._lock:
+            self.index_generation = os.path.basename(gen_dir)
+            if self._version == version:
+                self.ann = ann
+
+    def _import_legacy_query_cache(self):
+        """
+        Move a query_cache.json written by older versions into the shared query cache.
+        """
+        legacy_path = os.path.join(self.db_path, index_store.QUERY_CACHE_FILE)
+        if os.path.exists(legacy_path):
+            legacy = index_store.load_query_cache(self.db_path)
+            if legacy:
+                self.query_cache.put_many(QUERY_MODEL, list(legacy), list(legacy.values()))
+            os.remove(legacy_path)
 
     def load_db(self):
-        if not os.path.exists(self.db_path):
-            raise ValueError("Vector database file not found. Use load_data to create a new database.")
-        with open(self.db_path, "rb") as file:
-            data = pickle.load(file)
-        self.embeddings = data["embeddings"]
-        self.metadata = data["metadata"]
-        self.query_cache = json.loads(data["query_cache"])
+        self._ensure_index()
+        if not index_store.index_exists(self.db_path):
+            raise ValueError("Vector database not found. Use load_data to create a new database.")
+        gen_dir, header, embeddings, metadata = index_store.open_index(self.db_path)
+        # Memory-mapped and read-only: pages are shared between worker processes
+        # through the OS cache and only the rows that are touched get read.
+        with self._lock:
+            self.index_header = header
+            self.dtype = header["dtype"]
+            self._matrix = embeddings
+            self._size = len(embeddings)
+            self.metadata = metadata
+            self._deleted = set()
+            self._mutated()
+            # Side indexes from the generation opened above, never a newer one saved meanwhile
+            self.index_generation = os.path.basename(gen_dir)
+            if BM25Index.exists(gen_dir):
+                self.bm25 = BM25Index.load(gen_dir)
+            self.ann = IVFIndex.load(gen_dir) if IVFIndex.exists(gen_dir) else None
+            self.partitions = index_store.load_partitions(gen_dir)
+        self._import_legacy_query_cache()
 
     def validate_embedded_chunks(self):
+        from dedup import ChunkDeduplicator
+
         unique_contents = set()
         for meta in self.metadata:
             unique_contents.add(meta['content'])
+        deduplicator = ChunkDeduplicator()
+        near_unique = sum(1 for _ in deduplicator.filter(
+            {"school": meta.get("school"), "source_url": meta["source_url"],
+             "Chunk Number": meta.get("chunk_number"), "chunk_text": meta["content"]}
+            for meta in self.metadata
+        ))
     
         print(f"Validation results:")
         print(f"Total embedded chunks: {len(self.metadata)}")
         print(f"Unique embedded contents: {len(unique_contents)}")
+        print(f"Contents left after near-duplicate collapsing: {near_unique}")
     
-        if len(self.metadata) != len(unique_contents):
+        if len(self.metadata) != near_unique:
             print("Warning: There may be duplicate chunks in the embedded data.")
+            for line in deduplicator.report():
+                print(line)
         else:
             print("All embedded chunks are unique.")
 